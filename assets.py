@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+# Asset names end up in file names, so keep them simple
+ASSET_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+GS = bytes([0x1D])
+
+
+def nv_define_command(key, raster_command):
+    """
+    Build GS ( L / GS 8 L <Function 67>: store a raster image in the printer's
+    NV graphics memory under a two character key code.
+    :param raster_command: GS v 0 command as produced by rasterize_image.
+    """
+    bytes_per_line = raster_command[4] | (raster_command[5] << 8)
+    height = raster_command[6] | (raster_command[7] << 8)
+    width = bytes_per_line * 8
+    body = (
+        b"0C0"  # m=48, fn=67, a=48 (monochrome raster)
+        + key.encode("ascii")
+        + b"\x01"  # one colour
+        + bytes([width & 0xFF, (width >> 8) & 0xFF, height & 0xFF, (height >> 8) & 0xFF])
+        + b"1"  # colour 1
+        + raster_command[8:]
+    )
+    if len(body) <= 0xFFFF:
+        return GS + b"(L" + len(body).to_bytes(2, "little") + body
+    # Large images need the four byte length form
+    return GS + b"8L" + len(body).to_bytes(4, "little") + body
+
+
+def nv_print_command(key):
+    """GS ( L <Function 69>: print NV graphics stored under a key code at normal size"""
+    return GS + b"(L\x06\x000E" + key.encode("ascii") + b"\x01\x01"
+
+
+def nv_delete_command(key):
+    """GS ( L <Function 66>: remove NV graphics stored under a key code"""
+    return GS + b"(L\x04\x000B" + key.encode("ascii")
+
+
+class AssetStore:
+    """
+    Named images uploaded once and kept on disk, both as the original file
+    and pre-rasterized, so receipts can reference them by name.
+    """
+
+    def __init__(self, directory, rasterize):
+        """
+        :param directory: Where the images and index.json are kept.
+        :param rasterize: Callable (image_bytes) -> GS v 0 raster command.
+        """
+        self.directory = directory
+        self.rasterize = rasterize
+        self.index_path = os.path.join(directory, "index.json")
+        self.rasters = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"next_key": 0, "assets": {}}
+
+    def _write(self, path, data):
+        # Write to a temporary file first so a crash never leaves half a file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _save_index(self):
+        self._write(self.index_path, json.dumps(self.index, indent=2).encode())
+
+    def _path(self, name, suffix):
+        return os.path.join(self.directory, f"{name}{suffix}")
+
+    def _next_key(self):
+        # NV key codes are two printable ASCII characters (33-126)
+        n = self.index["next_key"]
+        self.index["next_key"] = n + 1
+        return chr(33 + (n // 94) % 94) + chr(33 + n % 94)
+
+    def put(self, name, image_data):
+        """
+        Store (or replace) an image and return its metadata.
+        :raise ValueError: The name isn't allowed or the data isn't an image.
+        """
+        if not ASSET_NAME_PATTERN.match(name):
+            raise ValueError("Asset names may only contain letters, digits, _ and -")
+        try:
+            raster = self.rasterize(image_data)
+        except OSError as e:
+            # PIL's UnidentifiedImageError and truncated files are OSErrors
+            raise ValueError(f"Not a readable image: {e}") from e
+        with self.lock:
+            previous = self.index["assets"].get(name)
+            meta = {
+                "name": name,
+                "key": previous["key"] if previous else self._next_key(),
+                "width": (raster[4] | (raster[5] << 8)) * 8,
+                "height": raster[6] | (raster[7] << 8),
+                "raster_bytes": len(raster),
+                "sha256": hashlib.sha256(image_data).hexdigest(),
+                "uploaded_at": time.time(),
+                # Any copy in printer NV memory is stale after a new upload
+                "nv_printers": [],
+            }
+            self._write(self._path(name, ".img"), image_data)
+            self._write(self._path(name, ".bin"), raster)
+            self.index["assets"][name] = meta
+            self.rasters[name] = raster
+            self._save_index()
+            return dict(meta)
+
+    def get(self, name):
+        with self.lock:
+            meta = self.index["assets"].get(name)
+            return dict(meta) if meta else None
+
+    def list(self):
+        with self.lock:
+            return [dict(meta) for meta in self.index["assets"].values()]
+
+    def raster(self, name):
+        """Return the GS v 0 command of an asset, or None if it does not exist"""
+        with self.lock:
+            if name not in self.index["assets"]:
+                return None
+            raster = self.rasters.get(name)
+            if raster is None:
+                with open(self._path(name, ".bin"), "rb") as f:
+                    raster = f.read()
+                self.rasters[name] = raster
+            return raster
+
+    def delete(self, name):
+        """Forget an asset, returning its metadata or None if it did not exist"""
+        with self.lock:
+            meta = self.index["assets"].pop(name, None)
+            if meta is None:
+                return None
+            self.rasters.pop(name, None)
+            for suffix in (".img", ".bin"):
+                try:
+                    os.remove(self._path(name, suffix))
+                except FileNotFoundError:
+                    pass
+            self._save_index()
+            return meta
+
+    def mark_nv(self, name, printer_name):
+        """Record that an asset has been downloaded into a printer's NV memory"""
+        with self.lock:
+            meta = self.index["assets"][name]
+            if printer_name not in meta["nv_printers"]:
+                meta["nv_printers"].append(printer_name)
+                self._save_index()
+
+    def nv_key(self, name, printer_name):
+        """Key code of an asset if it is stored in the printer's NV memory, else None"""
+        with self.lock:
+            meta = self.index["assets"].get(name)
+            if meta and printer_name in meta["nv_printers"]:
+                return meta["key"]
+            return None
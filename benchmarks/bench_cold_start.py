@@ -0,0 +1,200 @@
+"""
+Cold start benchmark of the print server.
+
+Measures, in fresh interpreters:
+- the time to import printer_server
+- the time from launching `printer_server.py --no-companions` until it
+  answers its first request, which is what matters after a power cut
+and lists the slowest imports (python -X importtime). Also checks that PIL
+is not imported until an image is printed.
+
+Run it on the target machine with the frozen executable's Python version.
+Only the Python overhead is measured: PyInstaller's bootloader unpacking
+of a --onefile build comes on top.
+
+Usage:
+    python benchmarks/bench_cold_start.py --save       # record a baseline
+    python benchmarks/bench_cold_start.py --compare    # compare to it
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = os.path.join(ROOT, "printer_server.py")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "cold_start_baseline.json")
+
+# Modules that should only be imported when they are needed
+DEFERRED_MODULES = ["PIL", "webbrowser", "cProfile"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_import():
+    """Seconds for a fresh interpreter to import printer_server"""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import printer_server"],
+        cwd=ROOT,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def time_first_request(timeout=30):
+    """Seconds from launching the server until it answers a request"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/metrics"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, SERVER, "--no-companions", "--port", str(port)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1):
+                    return time.perf_counter() - start
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {process.returncode}")
+                time.sleep(0.005)
+        raise RuntimeError(f"Server did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def slowest_imports(count=10):
+    """(cumulative ms, module) of the slowest top level imports"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import printer_server"],
+        cwd=ROOT,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        rows.append((len(name) - len(name.lstrip()), int(cumulative) / 1000, name.strip()))
+
+    # Modules are listed after their imports, and nested ones are indented
+    # two more spaces: walk back from printer_server to its direct imports
+    end = max(i for i, row in enumerate(rows) if row[2] == "printer_server")
+    imports = []
+    for indent, ms, name in reversed(rows[:end]):
+        if indent <= rows[end][0]:
+            break
+        if indent == rows[end][0] + 2:
+            imports.append((ms, name))
+    return sorted(imports, reverse=True)[:count]
+
+
+def eager_modules():
+    """Modules of DEFERRED_MODULES that importing printer_server loads anyway"""
+    code = (
+        "import sys, printer_server; "
+        f"print(' '.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True
+    )
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="server launches to time")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.0,
+        help="seconds the first request may take at most (default 1)",
+    )
+    parser.add_argument(
+        "--save", nargs="?", const=DEFAULT_BASELINE, help="write results as the baseline"
+    )
+    parser.add_argument(
+        "--compare", nargs="?", const=DEFAULT_BASELINE, help="compare against a baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20.0,
+        help="percent slowdown reported as a regression (default 20)",
+    )
+    args = parser.parse_args()
+
+    time_import()  # warm the OS file cache and the .pyc files
+    results = {
+        "import_s": round(statistics.median(time_import() for _ in range(args.runs)), 4),
+        "first_request_s": round(
+            statistics.median(time_first_request() for _ in range(args.runs)), 4
+        ),
+    }
+    print(f"import printer_server:   {results['import_s']:.3f}s (median of {args.runs})")
+    print(f"launch to first request: {results['first_request_s']:.3f}s (median of {args.runs})")
+
+    print("\nSlowest imports (cumulative):")
+    for ms, name in slowest_imports():
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failures = []
+    eager = eager_modules()
+    if eager:
+        failures.append(f"imported at startup instead of on first use: {', '.join(eager)}")
+    if results["first_request_s"] > args.budget:
+        failures.append(f"first request took longer than the {args.budget}s budget")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        print()
+        for key, value in results.items():
+            if key not in baseline:
+                continue
+            change = (value / baseline[key] - 1) * 100
+            print(f"{key:<16} {baseline[key]:.3f}s -> {value:.3f}s ({change:+.1f}%)")
+            if change > args.threshold:
+                failures.append(f"{key} regressed by {change:.1f}%")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nBaseline saved to {args.save}")
+
+    if failures:
+        print()
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
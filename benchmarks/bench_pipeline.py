@@ -0,0 +1,223 @@
+"""
+Benchmark suite for the receipt render and image pipeline.
+
+Times every stage of process_image (base64 decode, PIL decode, resize,
+dither, bit packing) on logos of several resolutions, and command assembly
+of generate_esc_pos_commands on synthetic receipts of increasing size.
+Also reports the peak Python memory allocated by each stage (PIL's pixel
+buffers are allocated in C and are not included).
+
+Runs anywhere: win32print is stubbed out so nothing is ever printed.
+
+Usage:
+    python benchmarks/bench_pipeline.py --save            # record a baseline
+    python benchmarks/bench_pipeline.py --compare         # compare to it
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Make "import win32print" fail so the server falls back to the sink transport
+sys.modules["win32print"] = None
+
+from printer_server import (  # noqa: E402
+    IMAGE_MAX_WIDTH,
+    fit_width,
+    generate_esc_pos_commands,
+    image_cache,
+    open_image,
+    process_image,
+    raster_command,
+    to_monochrome,
+)
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+LOGO_SIZES = [(128, 64), (312, 156), (640, 320), (1280, 640)]
+RECEIPT_ROWS = [5, 25, 100]
+
+
+def make_logo(width, height):
+    """RGBA logo with text, shapes and a gradient, base64 encoded as PNG"""
+    img = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    for x in range(0, width, 4):
+        shade = x * 255 // width
+        draw.line([(x, 0), (x, height // 3)], fill=(shade, shade, shade, 255), width=4)
+    draw.ellipse(
+        [width // 8, height // 3, width // 3, height - 4], fill=(200, 40, 40, 255)
+    )
+    for i in range(0, height, max(height // 8, 1)):
+        draw.text((width // 2, i), "CHICKEN HUT", fill=(0, 0, 0, 255))
+    buf = BytesIO()
+    img.save(buf, "PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def make_receipt(rows):
+    """Customer receipt with a table of rows, discounts and subtotals"""
+    content = [
+        {"type": "header", "text": "CHICKEN HUT"},
+        {"type": "address", "text": "House 12, Road 5, Dhanmondi, Dhaka"},
+        {"type": "phone", "text": "Tel: 01700-000000"},
+        {"type": "text", "text": "Table 7 - Order #1042", "align": "center"},
+        {"type": "table-header", "columns": ["No", "Item", "Qty", "Rate", "Total"]},
+    ]
+    for i in range(rows):
+        qty = i % 4 + 1
+        rate = 120 + i * 5
+        content.append(
+            {
+                "type": "table-row",
+                "columns": [str(i + 1), f"Menu item number {i}", str(qty), f"{rate}.00", str(qty * rate)],
+            }
+        )
+    content += [
+        {"type": "subtotal", "label": "Sub-total", "amount": "5400"},
+        {"type": "discount", "label": "Discount", "amount": "-250"},
+        {"type": "subtotal", "label": "VAT", "amount": "260"},
+        {"type": "total", "amount": "5410"},
+        {"type": "text", "text": "Thank you, come again!", "align": "center"},
+    ]
+    return content
+
+
+def make_kitchen_ticket(rows):
+    content = [
+        {"type": "header", "text": "KITCHEN"},
+        {"type": "text", "text": "Table 7"},
+        {"type": "text", "text": "12:41 18/10/2026"},
+    ]
+    content += [
+        {"type": "item", "name": f"Menu item number {i}", "quantity": i % 4 + 1}
+        for i in range(rows)
+    ]
+    return content
+
+
+def build_cases():
+    """Yield (case name, stage name, callable) for every measurement"""
+    for width, height in LOGO_SIZES:
+        case = f"logo {width}x{height}"
+        b64 = make_logo(width, height)
+        raw = base64.b64decode(b64)
+        opened = open_image(raw)
+        fitted = fit_width(opened, IMAGE_MAX_WIDTH)
+        mono = to_monochrome(fitted)
+
+        def uncached(b64=b64):
+            image_cache.clear()
+            return process_image(b64)
+
+        yield case, "base64 decode", lambda b64=b64: base64.b64decode(b64)
+        yield case, "pil decode", lambda raw=raw: open_image(raw)
+        yield case, "resize", lambda img=opened: fit_width(img, IMAGE_MAX_WIDTH)
+        yield case, "dither", lambda img=fitted: to_monochrome(img)
+        yield case, "bit packing", lambda img=mono: raster_command(img)
+        yield case, "process_image", uncached
+        yield case, "process_image cached", lambda b64=b64: process_image(b64)
+
+    for rows in RECEIPT_ROWS:
+        case = f"receipt {rows} rows"
+        receipt = make_receipt(rows)
+        kitchen = make_kitchen_ticket(rows)
+        yield case, "assembly customer", lambda c=receipt: generate_esc_pos_commands(c, "customer")
+        yield case, "assembly kitchen", lambda c=kitchen: generate_esc_pos_commands(c, "kitchen")
+
+
+def measure(func, repeat, min_time=0.05):
+    """Median and best time per call in ms, plus peak allocation in KiB"""
+    func()  # warm up (caches, lazy imports)
+    number = 1
+    while timeit.timeit(func, number=number) < min_time and number < 100000:
+        number *= 2
+    times = [t / number * 1000 for t in timeit.repeat(func, number=number, repeat=repeat)]
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(times), 4),
+        "min_ms": round(min(times), 4),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7, help="timing rounds per stage")
+    parser.add_argument(
+        "--save", nargs="?", const=DEFAULT_BASELINE, help="write results as the baseline"
+    )
+    parser.add_argument(
+        "--compare", nargs="?", const=DEFAULT_BASELINE, help="compare against a baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percent slowdown reported as a regression (default 10)",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    header = f"{'case':<20} {'stage':<22} {'median ms':>10} {'min ms':>10} {'peak KiB':>9}"
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header)
+    for case, stage, func in build_cases():
+        key = f"{case} / {stage}"
+        result = measure(func, args.repeat)
+        results[key] = result
+        row = (
+            f"{case:<20} {stage:<22} {result['median_ms']:>10.3f}"
+            f" {result['min_ms']:>10.3f} {result['peak_kib']:>9.1f}"
+        )
+        if key in baseline:
+            change = (result["median_ms"] / baseline[key]["median_ms"] - 1) * 100
+            row += f" {change:>+7.1f}%"
+            if change > args.threshold:
+                regressions.append((key, change))
+                row += "  REGRESSION"
+        print(row)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "pillow": Image.__version__,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nBaseline saved to {args.save}")
+
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) slower than the baseline by more than {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmark for the GS v 0 bit packing in process_image.
+
+Compares pack_raster against the per-pixel loop it replaced on 1-bit images
+of several sizes, checking that both produce exactly the same bytes.
+
+Usage: python benchmarks/bench_process_image.py [--repeat N]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from printer_server import pack_raster  # noqa: E402
+
+# (width, height) pairs; odd widths exercise the row padding
+SIZES = [(64, 64), (180, 90), (203, 101), (312, 156), (312, 400), (576, 576)]
+
+
+def legacy_pack_raster(img):
+    """The original triple loop from process_image, kept as the reference"""
+    width, height = img.size
+    command = bytearray()
+    pixels = list(img.getdata())
+    for y in range(height):
+        for x in range(0, width, 8):
+            byte_val = 0
+            for bit in range(8):
+                if x + bit < width:
+                    pixel = pixels[y * width + x + bit]
+                    if pixel == 0:
+                        byte_val |= 1 << (7 - bit)
+            command.append(byte_val)
+    return command
+
+
+def make_image(width, height, seed=0):
+    """Dithered grayscale noise with some structure, similar to a scanned logo"""
+    rng = random.Random(seed)
+    img = Image.new("L", (width, height))
+    img.putdata(
+        [
+            (x * 255 // width + rng.randint(-60, 60)) % 256
+            for y in range(height)
+            for x in range(width)
+        ]
+    )
+    return img.convert("1")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="runs per size")
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'legacy ms':>10} {'packed ms':>10} {'speedup':>8}")
+    for width, height in SIZES:
+        img = make_image(width, height)
+        if bytes(legacy_pack_raster(img)) != pack_raster(img):
+            sys.exit(f"Output mismatch for {width}x{height}")
+        legacy = min(
+            timeit.repeat(lambda: legacy_pack_raster(img), number=1, repeat=args.repeat)
+        )
+        packed = min(
+            timeit.repeat(lambda: pack_raster(img), number=1, repeat=args.repeat)
+        )
+        print(
+            f"{width:>4}x{height:<5} {legacy * 1000:>10.3f} {packed * 1000:>10.3f}"
+            f" {legacy / packed:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Golden check for the receipt renderer.
+
+Renders a fixed set of customer and kitchen receipts and compares the ESC/POS
+bytes with golden_receipts.json, which holds the output of the original
+renderer for each of them. Any difference is a regression in what gets
+printed. The receipts are ASCII only: non-ASCII text is converted by
+text_encoding and is expected to differ from the original.
+
+Runs anywhere: win32print is stubbed out so nothing is ever printed.
+
+Usage: python benchmarks/check_golden.py [--golden PATH]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Make "import win32print" fail so the server falls back to the sink transport
+sys.modules["win32print"] = None
+
+from printer_server import generate_esc_pos_commands  # noqa: E402
+
+DEFAULT_GOLDEN = os.path.join(ROOT, "benchmarks", "golden_receipts.json")
+
+
+def first_difference(expected, actual):
+    """Offset of the first byte where actual differs from expected"""
+    for offset, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return offset
+    return min(len(expected), len(actual))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN, help="golden receipts file")
+    args = parser.parse_args()
+
+    with open(args.golden) as f:
+        receipts = json.load(f)["receipts"]
+
+    for index, receipt in enumerate(receipts):
+        expected = base64.b64decode(receipt["expected"])
+        actual = bytes(generate_esc_pos_commands(receipt["content"], receipt["print_type"]))
+        # Render twice, the second time from the warm image and text caches
+        cached = bytes(generate_esc_pos_commands(receipt["content"], receipt["print_type"]))
+        for output in (actual, cached):
+            if output != expected:
+                offset = first_difference(expected, output)
+                sys.exit(
+                    f"Output mismatch for receipt {index} ({receipt['print_type']}) at byte"
+                    f" {offset}: expected {expected[offset:offset + 16]!r},"
+                    f" got {output[offset:offset + 16]!r}"
+                )
+    print(f"OK: {len(receipts)} receipts match the golden output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+End-to-end load test of the print server against virtual printers.
+
+Starts a virtual counter printer and kitchen printer (see virtual_printer.py),
+serves the Flask app with the routes pointed at them over raw TCP, and fires
+concurrent /print traffic: a mix of customer receipts (some with a logo) and
+kitchen tickets. Every job is followed through /jobs/<id> until it has been
+handed to the printer, so the latencies include queueing and rendering;
+the virtual printers then report when the paper actually came out.
+
+Usage:
+    python benchmarks/load_test.py --jobs 200 --concurrency 16
+    python benchmarks/load_test.py --url http://printer-pc:5000   # existing server
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import make_kitchen_ticket, make_logo, make_receipt  # noqa: E402
+from virtual_printer import VirtualPrinter  # noqa: E402
+
+
+def start_local_server(counter, kitchen):
+    """Serve the app on a free port with its printers pointed at the virtual ones"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    import printer_server
+
+    printer_server.PRINTER_TRANSPORTS.update(
+        {
+            "Virtual Counter": {"type": "tcp", "host": counter.host, "port": counter.port},
+            "Virtual Kitchen": {"type": "tcp", "host": kitchen.host, "port": kitchen.port},
+        }
+    )
+    printer_server.PRINTER_ROUTES.update(
+        {"customer": "Virtual Counter", "kitchen": "Virtual Kitchen"}
+    )
+    server = make_server(
+        "127.0.0.1", 0, printer_server.app, threaded=True, request_handler=QuietHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def call(url, api_key, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(
+        url,
+        data=data,
+        headers={"Content-Type": "application/json", "X-API-KEY": api_key},
+        method="POST" if body is not None else "GET",
+    )
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        return resp.status, json.loads(resp.read())
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LoadTest:
+    def __init__(self, url, api_key, logo_ratio, kitchen_ratio, timeout):
+        self.url = url
+        self.api_key = api_key
+        self.logo_ratio = logo_ratio
+        self.kitchen_ratio = kitchen_ratio
+        self.timeout = timeout
+        self.logo = make_logo(312, 156)
+        self.accept_ms = []
+        self.total_ms = []
+        self.errors = {}
+        # 429 answers that were retried after Retry-After
+        self.throttled = 0
+        self.sent = {"customer": 0, "kitchen": 0}
+        self.lock = threading.Lock()
+
+    def _error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def make_request(self, rng):
+        if rng.random() < self.kitchen_ratio:
+            return {"content": make_kitchen_ticket(rng.randint(1, 8)), "print_type": "kitchen"}
+        content = make_receipt(rng.randint(2, 15))
+        if rng.random() < self.logo_ratio:
+            content.insert(0, {"type": "image", "data": self.logo})
+        return {"content": content, "print_type": "customer"}
+
+    def run_one(self, seed):
+        body = self.make_request(random.Random(seed))
+        start = time.perf_counter()
+        while True:
+            try:
+                status, reply = call(self.url + "/print", self.api_key, body)
+                break
+            except urllib.error.HTTPError as e:
+                if e.code != 429:
+                    self._error(f"http {e.code}")
+                    return
+                # Rate limited or queue full: back off as told, like a POS would
+                with self.lock:
+                    self.throttled += 1
+                time.sleep(float(e.headers.get("Retry-After", 1)))
+            except OSError as e:
+                self._error(type(e).__name__)
+                return
+        accepted = time.perf_counter()
+
+        job_id = reply.get("job_id")
+        if job_id is None:
+            # Server without the job queue: the print already happened
+            job = {"status": "done" if reply.get("success") else "failed"}
+        else:
+            deadline = accepted + self.timeout
+            while True:
+                try:
+                    _, job = call(f"{self.url}/jobs/{job_id}", self.api_key)
+                except urllib.error.HTTPError as e:
+                    if e.code != 429:
+                        raise
+                    time.sleep(float(e.headers.get("Retry-After", 1)))
+                    continue
+                if job["status"] in ("done", "failed") or time.perf_counter() > deadline:
+                    break
+                time.sleep(0.02)
+        finished = time.perf_counter()
+
+        if job["status"] != "done":
+            self._error("job " + job["status"])
+            return
+        with self.lock:
+            self.sent[body["print_type"]] += 1
+            self.accept_ms.append((accepted - start) * 1000)
+            self.total_ms.append((finished - start) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=100, help="requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel clients")
+    parser.add_argument("--url", help="test a running server instead of a local one")
+    parser.add_argument("--api-key", default="your-secret-api-key")
+    parser.add_argument("--logo-ratio", type=float, default=0.3, help="receipts with a logo")
+    parser.add_argument("--kitchen-ratio", type=float, default=0.4, help="share of kitchen tickets")
+    parser.add_argument("--bps", type=int, default=12000, help="virtual printer bytes/sec")
+    parser.add_argument("--cut-time", type=float, default=0.4, help="virtual printer seconds per cut")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for a job")
+    args = parser.parse_args()
+
+    printers = []
+    url = args.url
+    if url is None:
+        counter = VirtualPrinter(bytes_per_sec=args.bps, cut_time=args.cut_time, port=0).start()
+        kitchen = VirtualPrinter(bytes_per_sec=args.bps, cut_time=args.cut_time, port=0).start()
+        printers = [("counter", counter), ("kitchen", kitchen)]
+        _, url = start_local_server(counter, kitchen)
+
+    test = LoadTest(url, args.api_key, args.logo_ratio, args.kitchen_ratio, args.timeout)
+    print(f"Sending {args.jobs} jobs to {url} with {args.concurrency} clients...")
+    start = time.perf_counter()
+    start_wall = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(test.run_one, range(args.jobs)))
+    elapsed = time.perf_counter() - start
+
+    done = len(test.total_ms)
+    failed = sum(test.errors.values())
+    print(f"\nCompleted {done} jobs in {elapsed:.2f}s ({done / elapsed:.2f} jobs/sec)")
+    print(f"Errors: {failed} ({failed / args.jobs:.1%})", test.errors or "")
+    if test.throttled:
+        print(f"Throttled: {test.throttled} requests got 429 and were retried")
+    for label, values in (("accepted", test.accept_ms), ("spooled", test.total_ms)):
+        if values:
+            print(
+                f"{label:>8} latency ms: p50 {percentile(values, 50):.1f}"
+                f"  p95 {percentile(values, 95):.1f}  p99 {percentile(values, 99):.1f}"
+                f"  mean {statistics.mean(values):.1f}"
+            )
+
+    # Spooled jobs may still be in the printer's buffer; wait for the paper
+    for name, printer in printers:
+        expected = test.sent["customer" if name == "counter" else "kitchen"]
+        printer.wait_for(expected, args.timeout)
+        stats = printer.stats()
+        line = f"virtual {name} printer: {stats['jobs']} jobs, {stats['bytes']} bytes"
+        if stats["jobs"]:
+            took = stats["last_printed_at"] - start_wall
+            line += f", all printed after {took:.2f}s ({stats['jobs'] / took:.2f} jobs/sec)"
+        print(line)
+        printer.stop()
+
+
+if __name__ == "__main__":
+    main()
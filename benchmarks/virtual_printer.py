@@ -0,0 +1,148 @@
+"""
+Virtual ESC/POS network printer for load testing.
+
+Listens on TCP (port 9100 by default) like a real network receipt printer,
+consumes data at a limited rate to simulate print speed, spends extra time
+on every paper cut and records each job it receives. Jobs are split on the
+cut command. Real-time status requests (DLE EOT) are answered with
+"online, paper present".
+
+Usage: python benchmarks/virtual_printer.py [--port 9100] [--bps 12000] [--cut-time 0.4]
+"""
+import argparse
+import socket
+import threading
+import time
+
+CUT = b"\x1dVA\x03"
+DLE_EOT = b"\x10\x04"
+# Status replies: fixed bits set, online, no paper problems
+STATUS_OK = b"\x12"
+
+
+class VirtualPrinter:
+    """Threaded TCP server pretending to be an ESC/POS printer"""
+
+    def __init__(self, host="127.0.0.1", port=9100, bytes_per_sec=12000, cut_time=0.4):
+        """
+        :param bytes_per_sec: How fast data is consumed. A 80mm printer at
+            ~150mm/s prints a text line of 48 chars (24 dots high) in about
+            20ms; raster images are much slower per byte than text.
+        :param cut_time: Seconds the auto cutter takes per cut.
+        """
+        self.host = host
+        self.port = port
+        self.bytes_per_sec = bytes_per_sec
+        self.cut_time = cut_time
+        self.jobs = []  # dicts with bytes, received_at and printed_at
+        self.lock = threading.Lock()
+        # There is only one print head, whatever the number of connections
+        self.mechanism = threading.Lock()
+        self.sock = None
+        self.running = False
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            self.sock.close()
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        pending = bytearray()
+        started = None
+        with conn:
+            while self.running:
+                try:
+                    chunk = conn.recv(4096)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                if started is None:
+                    started = time.time()
+                pending.extend(chunk)
+                cuts = chunk.count(CUT)
+                with self.mechanism:
+                    time.sleep(len(chunk) / self.bytes_per_sec + cuts * self.cut_time)
+                while True:
+                    if pending.startswith(DLE_EOT) and len(pending) >= 3:
+                        # Real-time status query between jobs
+                        conn.sendall(STATUS_OK)
+                        del pending[:3]
+                    elif CUT in pending:
+                        end = pending.index(CUT) + len(CUT)
+                        self._record(bytes(pending[:end]), started)
+                        del pending[:end]
+                    else:
+                        break
+                    started = time.time() if pending else None
+
+    def _record(self, data, received_at):
+        with self.lock:
+            self.jobs.append(
+                {"bytes": len(data), "received_at": received_at, "printed_at": time.time()}
+            )
+
+    def wait_for(self, count, timeout=60):
+        """Block until at least count jobs have been printed, or timeout"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if len(self.jobs) >= count:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self):
+        with self.lock:
+            jobs = list(self.jobs)
+        return {
+            "jobs": len(jobs),
+            "bytes": sum(job["bytes"] for job in jobs),
+            "last_printed_at": max((job["printed_at"] for job in jobs), default=None),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--bps", type=int, default=12000, help="bytes printed per second")
+    parser.add_argument("--cut-time", type=float, default=0.4, help="seconds per cut")
+    args = parser.parse_args()
+
+    printer = VirtualPrinter(args.host, args.port, args.bps, args.cut_time).start()
+    print(f"Virtual printer listening on {args.host}:{printer.port}")
+    seen = 0
+    try:
+        while True:
+            time.sleep(0.5)
+            with printer.lock:
+                new_jobs = printer.jobs[seen:]
+            for number, job in enumerate(new_jobs, seen + 1):
+                took = job["printed_at"] - job["received_at"]
+                print(f"job {number}: {job['bytes']} bytes printed in {took:.2f}s")
+            seen += len(new_jobs)
+    except KeyboardInterrupt:
+        printer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class RasterCache:
+    """
+    LRU cache of rendered ESC/POS image commands, bounded by total bytes.
+    Entries are keyed by a hash of the image payload and its render
+    parameters, so the same logo sent on every receipt is rasterized once.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(payload, **params):
+        """Hash an image payload (str or bytes) together with its render parameters"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        digest = hashlib.sha256(payload)
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached bytes for a key, or None on a miss"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store bytes under a key, evicting least recently used entries to fit"""
+        value = bytes(value)
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Counters for the operator facing /image-cache endpoint"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,823 @@
+import itertools
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Lifecycle of a print job, in order
+JOB_STATES = ("queued", "rendering", "printing", "done", "failed")
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when accepting jobs would go over a printer's queue budget"""
+
+    def __init__(self, printer, retry_after):
+        super().__init__(f"Print queue of {printer} is full")
+        self.printer = printer
+        # Seconds until the queue has likely drained enough
+        self.retry_after = retry_after
+
+
+class BatchTooLarge(Exception):
+    """Raised when a batch alone is over a printer's queue budget"""
+
+    def __init__(self, printer):
+        super().__init__(f"Batch is larger than the print queue of {printer}")
+        self.printer = printer
+
+
+def content_size(content):
+    """Rough size of a job's content in bytes, dominated by image data"""
+    size = 0
+    for line in content:
+        size += 64
+        if isinstance(line, dict):
+            for key in ("data", "blob"):
+                value = line.get(key)
+                if isinstance(value, (str, bytes, bytearray)):
+                    size += len(value)
+    return size
+
+
+class PrintJob:
+    """A single print request and its progress through the queue"""
+
+    def __init__(self, content, print_type="customer", printer=None, priority=1):
+        self.id = uuid.uuid4().hex
+        self.content = content
+        self.print_type = print_type
+        self.printer = printer
+        # Lower runs first, see PriorityJobQueue
+        self.priority = priority
+        # Counted against the printer's queue budget until the job finishes
+        self.size = content_size(content)
+        # Physical printer the job was sent to, differs from printer for pools
+        self.device = printer
+        self.attempts = 0
+        self.status = "queued"
+        self.error = None
+        # Size of the rendered ESC/POS data
+        self.bytes = None
+        self.created_at = time.time()
+        # perf_counter() timestamps of each state change, used for timings
+        self.timestamps = {"queued": time.perf_counter()}
+        self.finished = threading.Event()
+        # Callable (job) called once when the job is done or failed
+        self.on_finish = None
+        # Jobs coalesced into this one; they follow its status
+        self.merged = []
+        self.merged_into = None
+
+    def set_status(self, status, error=None):
+        """Move the job to a new state and record when it happened"""
+        self.status = status
+        self.timestamps[status] = time.perf_counter()
+        if error is not None:
+            self.error = error
+        for job in self.merged:
+            # Printed as part of this job, on the same printer
+            job.device = self.device
+            job.bytes = self.bytes
+            job.set_status(status, error)
+        if status in ("done", "failed") and not self.finished.is_set():
+            self.finished.set()
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(self)
+                except Exception as e:
+                    log.error(
+                        "Error in finish callback of job %s: %s", self.id, e,
+                        extra={"job_id": self.id},
+                    )
+
+    def wait(self, timeout=None):
+        """Block until the job is done or failed"""
+        return self.finished.wait(timeout)
+
+    def _elapsed_ms(self, start, end):
+        if start not in self.timestamps or end not in self.timestamps:
+            return None
+        return round((self.timestamps[end] - self.timestamps[start]) * 1000, 2)
+
+    def to_dict(self):
+        """JSON friendly view of the job for the /jobs endpoint"""
+        end = "done" if self.status == "done" else "failed"
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "print_type": self.print_type,
+            "priority": self.priority,
+            "printer": self.printer,
+            "device": self.device,
+            "attempts": self.attempts,
+            "error": self.error,
+            "bytes": self.bytes,
+            "merged_into": self.merged_into,
+            "created_at": self.created_at,
+            "timings": {
+                "queue_ms": self._elapsed_ms("queued", "rendering"),
+                "render_ms": self._elapsed_ms("rendering", "printing"),
+                "print_ms": self._elapsed_ms("printing", end),
+                "total_ms": self._elapsed_ms("queued", end),
+            },
+        }
+
+
+class PriorityJobQueue:
+    """
+    Queue of job lists where the lowest priority number is served first.
+    Waiting lowers the effective priority by one class every aging seconds,
+    so low priority jobs can't starve. Equal priorities are served in order.
+    """
+
+    def __init__(self, aging=30):
+        self.aging = aging
+        self.entries = []  # (priority, enqueued_at, sequence, jobs)
+        self.sequence = itertools.count()
+        self.not_empty = threading.Condition()
+
+    def put(self, jobs):
+        priority = min(job.priority for job in jobs)
+        with self.not_empty:
+            self.entries.append(
+                (priority, time.monotonic(), next(self.sequence), jobs)
+            )
+            self.not_empty.notify()
+
+    def _effective(self, entry, now):
+        priority, enqueued_at, sequence, _ = entry
+        if self.aging:
+            priority -= (now - enqueued_at) / self.aging
+        return priority, sequence
+
+    def get(self):
+        """Block until there is an entry and return the most urgent one"""
+        with self.not_empty:
+            while not self.entries:
+                self.not_empty.wait()
+            now = time.monotonic()
+            best = min(
+                range(len(self.entries)),
+                key=lambda i: self._effective(self.entries[i], now),
+            )
+            return self.entries.pop(best)[3]
+
+    def drain(self):
+        """Remove and return every waiting job"""
+        with self.not_empty:
+            entries, self.entries = self.entries, []
+        return [job for entry in entries for job in entry[3]]
+
+    def depth(self):
+        with self.not_empty:
+            return sum(len(entry[3]) for entry in self.entries)
+
+
+class PrinterWorker:
+    """
+    Drains the job queue of one printer on a dedicated thread.
+    Each queue entry is a list of jobs that are sent as a single document.
+    """
+
+    def __init__(
+        self,
+        printer_name,
+        render,
+        send,
+        render_pool=None,
+        on_failure=None,
+        aging=30,
+        profiler=None,
+    ):
+        """
+        :param printer_name: Printer this worker owns.
+        :param render: Callable (content, print_type, printer_name) -> raw ESC/POS bytes.
+        :param send: Callable (printer_name, raw_data) -> (success, message).
+        :param render_pool: Executor used to render the jobs of a batch concurrently.
+        :param on_failure: Callable (worker, jobs, message) called when sending
+            fails. Returns True if it took care of the jobs (e.g. rerouted
+            them), otherwise they are marked failed.
+        :param aging: Seconds of waiting that raise a job by one priority class.
+        :param profiler: profiling.Profiler that may sample the processing of jobs.
+        """
+        self.printer_name = printer_name
+        self.render = render
+        self.send = send
+        self.render_pool = render_pool
+        self.on_failure = on_failure
+        self.profiler = profiler
+        self.active = 0
+        self.queue = PriorityJobQueue(aging)
+        self.thread = threading.Thread(
+            target=self._run, name=f"printer-worker-{printer_name}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, job):
+        self.queue.put([job])
+
+    def submit_batch(self, jobs):
+        """Queue jobs that should go to the printer together in one document"""
+        self.queue.put(list(jobs))
+
+    def depth(self):
+        """Number of jobs waiting for this printer"""
+        return self.queue.depth()
+
+    def load(self):
+        """Jobs waiting plus jobs being printed right now"""
+        return self.depth() + self.active
+
+    def drain(self):
+        """Remove and return every job still waiting in the queue"""
+        return self.queue.drain()
+
+    def _run(self):
+        while True:
+            jobs = self.queue.get()
+            self.active = len(jobs)
+            try:
+                self._process(jobs)
+            except Exception as e:
+                # Nothing may end the worker, its queue would never drain
+                log.exception(
+                    "Error in printer worker %s: %s", self.printer_name, e,
+                    extra={"printer": self.printer_name},
+                )
+                for job in jobs:
+                    if not job.finished.is_set():
+                        job.set_status("failed", str(e))
+            finally:
+                self.active = 0
+
+    def _render(self, job):
+        try:
+            job.set_status("rendering")
+            return self.render(job.content, job.print_type, self.printer_name)
+        except Exception as e:
+            log.error(
+                "Error processing job %s: %s", job.id, e,
+                extra={"job_id": job.id, "printer": self.printer_name},
+            )
+            job.set_status("failed", str(e))
+            return None
+
+    def _process(self, jobs):
+        profiler = self.profiler
+        if profiler is not None and profiler.session is not None:
+            # Render on this thread so the profile covers the whole job
+            profiler.profile(
+                [job.print_type for job in jobs], self._process_jobs, jobs, False
+            )
+            return
+        self._process_jobs(jobs)
+
+    def _process_jobs(self, jobs, concurrent=True):
+        if concurrent and len(jobs) > 1 and self.render_pool is not None:
+            rendered = list(self.render_pool.map(self._render, jobs))
+        else:
+            rendered = [self._render(job) for job in jobs]
+
+        # Jobs that rendered fine are sent together in a single document
+        ready = [(job, data) for job, data in zip(jobs, rendered) if data is not None]
+        if not ready:
+            return
+        for job, data in ready:
+            job.bytes = len(data)
+            job.set_status("printing")
+        try:
+            if len(ready) == 1:
+                payload = ready[0][1]
+            else:
+                payload = bytearray()
+                for _, data in ready:
+                    payload.extend(data)
+            success, message = self.send(self.printer_name, payload)
+        except Exception as e:
+            success, message = False, str(e)
+        if success:
+            for job, _ in ready:
+                job.set_status("done")
+            return
+        failed = [job for job, _ in ready]
+        if self.on_failure is not None and self.on_failure(self, failed, message):
+            return
+        for job in failed:
+            job.set_status("failed", message)
+
+
+class PrinterPool:
+    """A logical printer backed by several identical physical printers"""
+
+    def __init__(self, name, members):
+        self.name = name
+        self.members = list(members)
+        # member -> reason it was taken out of rotation
+        self.unhealthy = {}
+        # Jobs waiting for any member to come back
+        self.pending = []
+
+    def healthy_members(self):
+        return [m for m in self.members if m not in self.unhealthy]
+
+
+class JobManager:
+    """Keeps track of submitted jobs and the worker of each printer"""
+
+    # A job is failed after being rerouted this many times within a pool
+    MAX_ATTEMPTS = 3
+    # Seconds per job assumed for drain estimates until one has finished
+    DEFAULT_JOB_SECONDS = 1.0
+
+    def __init__(
+        self,
+        render,
+        send,
+        max_jobs=1000,
+        render_threads=4,
+        pools=None,
+        status=None,
+        health_interval=5,
+        priorities=None,
+        default_priority=1,
+        aging=30,
+        on_finish=None,
+        profiler=None,
+        journal=None,
+        max_queued_jobs=None,
+        max_queued_bytes=None,
+        coalesce_seconds=0,
+        coalesce_key=None,
+        mergeable=None,
+        merge=None,
+    ):
+        """
+        :param render: Passed to every PrinterWorker.
+        :param send: Passed to every PrinterWorker.
+        :param max_jobs: How many finished jobs to remember for /jobs lookups.
+        :param render_threads: Threads shared by all workers to render batches.
+        :param pools: Dict of logical printer name -> list of physical printers.
+        :param status: Callable (printer_name) -> dict with "online",
+            "paper_out" and "error" flags, or None when unknown. Used to take
+            pool members out of rotation and bring them back.
+        :param health_interval: Seconds between status checks of pool members.
+        :param priorities: Dict of priority class (a print_type or a name like
+            "reprint") -> priority number, lower is printed first.
+        :param default_priority: Priority of classes missing from priorities.
+        :param aging: Seconds of waiting that raise a job by one priority class.
+        :param on_finish: Callable (job) called once when a job is done or failed.
+        :param profiler: Passed to every PrinterWorker.
+        :param journal: journal.JobJournal recording accepted jobs until they
+            finish, so they can be replayed after a crash.
+        :param max_queued_jobs: Unfinished jobs a printer (or pool) may have
+            before new ones are refused with QueueFull, None for no limit.
+        :param max_queued_bytes: Same for the total content size of the jobs.
+        :param coalesce_seconds: How long jobs with the same coalesce_key are
+            held, from the first one, to be printed as one. 0 to not hold.
+        :param coalesce_key: Callable (job) -> key of the jobs it may be
+            merged with, or None to print it right away.
+        :param mergeable: Callable (job) -> whether the job may be merged.
+            A job that may not is printed right away, after the jobs held
+            under its key, so it doesn't overtake them.
+        :param merge: Callable (list of contents) -> merged content.
+        """
+        self.render = render
+        self.send = send
+        self.max_jobs = max_jobs
+        self.render_pool = ThreadPoolExecutor(
+            max_workers=render_threads, thread_name_prefix="render"
+        )
+        self.workers = {}
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.pools = {
+            name: PrinterPool(name, members) for name, members in (pools or {}).items()
+        }
+        # physical printer -> pool it belongs to
+        self.member_of = {
+            member: pool for pool in self.pools.values() for member in pool.members
+        }
+        self.status = status
+        self.health_interval = health_interval
+        self.priorities = priorities or {}
+        self.default_priority = default_priority
+        self.aging = aging
+        self.on_finish = on_finish
+        self.profiler = profiler
+        self.journal = journal
+        self.max_queued_jobs = max_queued_jobs
+        self.max_queued_bytes = max_queued_bytes
+        # printer -> [unfinished jobs, their content bytes]
+        self.backlog = {}
+        # printer -> moving average of seconds from rendering to finished
+        self.job_seconds = {}
+        self.coalesce_seconds = coalesce_seconds
+        self.coalesce_key = coalesce_key
+        self.mergeable = mergeable
+        self.merge = merge
+        # coalesce key -> jobs held until the window closes
+        self.held = {}
+        if self.pools and status is not None:
+            threading.Thread(
+                target=self._monitor_health, name="printer-health", daemon=True
+            ).start()
+
+    def worker(self, printer_name):
+        """Return the worker for a printer, starting it on first use"""
+        with self.lock:
+            worker = self.workers.get(printer_name)
+            if worker is None:
+                worker = PrinterWorker(
+                    printer_name,
+                    self.render,
+                    self.send,
+                    self.render_pool,
+                    on_failure=self._handle_failure,
+                    aging=self.aging,
+                    profiler=self.profiler,
+                )
+                self.workers[printer_name] = worker
+            return worker
+
+    def _dispatch(self, printer, jobs):
+        """Queue jobs on a printer, picking the least busy member for pools"""
+        pool = self.pools.get(printer)
+        if pool is None:
+            self.worker(printer).submit_batch(jobs)
+            return
+        # Under the lock _bring_back takes, so jobs can't be left pending
+        # by a member coming back between the check and the append
+        with self.lock:
+            members = pool.healthy_members()
+            if not members:
+                # Hold on to the jobs until a member is back in rotation
+                pool.pending.extend(jobs)
+                return
+        member = min(members, key=lambda m: self.worker(m).load())
+        for job in jobs:
+            job.device = member
+        self.worker(member).submit_batch(jobs)
+
+    def _handle_failure(self, worker, jobs, message):
+        """Take a failing pool member out of rotation and reroute its jobs"""
+        pool = self.member_of.get(worker.printer_name)
+        if pool is None:
+            return False
+        self._take_out(pool, worker.printer_name, message)
+        for job in jobs:
+            job.attempts += 1
+            if job.attempts >= self.MAX_ATTEMPTS:
+                job.set_status("failed", message)
+            else:
+                job.set_status("queued")
+                self._dispatch(pool.name, [job])
+        return True
+
+    def _take_out(self, pool, member, reason):
+        if member not in pool.unhealthy:
+            log.warning(
+                "Taking printer %s out of %s: %s", member, pool.name, reason,
+                extra={"printer": member, "pool": pool.name},
+            )
+        with self.lock:
+            pool.unhealthy[member] = reason
+        # Everything still waiting on this member goes to the others
+        for job in self.worker(member).drain():
+            job.set_status("queued")
+            self._dispatch(pool.name, [job])
+
+    def _bring_back(self, pool, member):
+        log.info(
+            "Printer %s is back in %s", member, pool.name,
+            extra={"printer": member, "pool": pool.name},
+        )
+        with self.lock:
+            pool.unhealthy.pop(member, None)
+            pending, pool.pending = pool.pending, []
+        for job in pending:
+            self._dispatch(pool.name, [job])
+
+    def check_health(self):
+        """Poll every pool member once and update the rotation"""
+        for pool in self.pools.values():
+            for member in pool.members:
+                try:
+                    status = self.status(member)
+                except Exception as e:
+                    status = {"online": False, "error": True, "reason": str(e)}
+                if status is None:
+                    # Unknown status: only failed sends take it out of rotation
+                    continue
+                if not status.get("online", True):
+                    problem = status.get("reason", "offline")
+                elif status.get("paper_out"):
+                    problem = "paper out"
+                elif status.get("error"):
+                    problem = status.get("reason", "printer error")
+                else:
+                    problem = None
+                if problem:
+                    self._take_out(pool, member, problem)
+                elif member in pool.unhealthy:
+                    self._bring_back(pool, member)
+
+    def _monitor_health(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.check_health()
+            except Exception as e:
+                log.error("Error checking printer health: %s", e)
+
+    def pool_status(self):
+        """Members, rotation and load of every pool, for the /pools endpoint"""
+        return {
+            pool.name: {
+                "members": [
+                    {
+                        "printer": member,
+                        "healthy": member not in pool.unhealthy,
+                        "reason": pool.unhealthy.get(member),
+                        "load": self.worker(member).load(),
+                    }
+                    for member in pool.members
+                ],
+                "pending": len(pool.pending),
+            }
+            for pool in self.pools.values()
+        }
+
+    def queue_depths(self):
+        """Jobs waiting per printer, including jobs held back by pools"""
+        with self.lock:
+            workers = list(self.workers.items())
+            depths = {name: worker.depth() for name, worker in workers}
+            for pool in self.pools.values():
+                depths[pool.name] = len(pool.pending)
+        return depths
+
+    def backlogs(self):
+        """Unfinished jobs and bytes per printer, counted against the budgets"""
+        with self.lock:
+            return {
+                printer: {"jobs": jobs, "bytes": size}
+                for printer, (jobs, size) in self.backlog.items()
+            }
+
+    def drain_seconds(self, printer):
+        """Estimated time for a printer to finish its unfinished jobs"""
+        with self.lock:
+            jobs = self.backlog.get(printer, (0, 0))[0]
+            per_job = self.job_seconds.get(printer, self.DEFAULT_JOB_SECONDS)
+        pool = self.pools.get(printer)
+        parallel = len(pool.healthy_members()) if pool is not None else 1
+        return jobs * per_job / max(parallel, 1)
+
+    def _admit(self, jobs, check=True):
+        """
+        Count jobs against their printers' budgets, all or none.
+        :raise QueueFull: A printer would go over its budget. A printer with
+            nothing queued always accepts a single job, so an oversized job
+            isn't refused forever.
+        :raise BatchTooLarge: Several jobs for one printer are over its budget
+            even with nothing queued, so retrying wouldn't help.
+        """
+        added = OrderedDict()
+        for job in jobs:
+            totals = added.setdefault(job.printer, [0, 0])
+            totals[0] += 1
+            totals[1] += job.size
+        full = None
+        too_large = None
+        with self.lock:
+            for printer, (jobs_added, bytes_added) in added.items():
+                if not check:
+                    continue
+                if jobs_added > 1 and (
+                    (self.max_queued_jobs is not None and jobs_added > self.max_queued_jobs)
+                    or (self.max_queued_bytes is not None and bytes_added > self.max_queued_bytes)
+                ):
+                    too_large = printer
+                    break
+                queued, queued_bytes = self.backlog.get(printer, (0, 0))
+                if not queued:
+                    continue
+                over = 0.0
+                if self.max_queued_jobs is not None:
+                    over = max(over, (queued + jobs_added - self.max_queued_jobs) / queued)
+                if self.max_queued_bytes is not None:
+                    over = max(
+                        over,
+                        (queued_bytes + bytes_added - self.max_queued_bytes)
+                        / max(queued_bytes, 1),
+                    )
+                if over > 0:
+                    full = (printer, min(over, 1.0))
+                    break
+            if full is None and too_large is None:
+                for printer, (jobs_added, bytes_added) in added.items():
+                    totals = self.backlog.setdefault(printer, [0, 0])
+                    totals[0] += jobs_added
+                    totals[1] += bytes_added
+        if too_large is not None:
+            raise BatchTooLarge(too_large)
+        if full is not None:
+            printer, fraction = full
+            # Time until enough of the queue has printed for these jobs to fit
+            retry_after = math.ceil(self.drain_seconds(printer) * fraction)
+            raise QueueFull(printer, max(retry_after, 1))
+
+    def _release(self, job):
+        with self.lock:
+            totals = self.backlog.get(job.printer)
+            if totals is not None:
+                totals[0] -= 1
+                totals[1] -= job.size
+                if totals[0] <= 0:
+                    del self.backlog[job.printer]
+            started = job.timestamps.get("rendering")
+            if started is not None:
+                seconds = job.timestamps[job.status] - started
+                average = self.job_seconds.get(job.printer)
+                self.job_seconds[job.printer] = (
+                    seconds if average is None else 0.8 * average + 0.2 * seconds
+                )
+
+    def _hold(self, jobs):
+        """
+        Hold jobs that may be coalesced, returning the ones to dispatch now.
+        The first job of a key opens a window of coalesce_seconds.
+        """
+        if not self.coalesce_seconds or self.coalesce_key is None:
+            return jobs
+        ready = []
+        for job in jobs:
+            key = self.coalesce_key(job)
+            if key is None:
+                ready.append(job)
+                continue
+            if self.mergeable is not None and not self.mergeable(job):
+                self._flush(key)
+                ready.append(job)
+                continue
+            with self.lock:
+                held = self.held.get(key)
+                if held is None:
+                    held = self.held[key] = [job]
+                    timer = threading.Timer(
+                        self.coalesce_seconds, self._flush, (key, held)
+                    )
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    held.append(job)
+        return ready
+
+    def _flush(self, key, held=None):
+        """
+        Print the jobs held under key as one job.
+        :param held: Only flush if this is still the list held under key,
+            so the timer of a window flushed early leaves the next one alone.
+        """
+        with self.lock:
+            if held is not None and self.held.get(key) is not held:
+                return
+            jobs = self.held.pop(key, [])
+        if not jobs:
+            return
+        carrier = jobs[0]
+        if len(jobs) > 1:
+            try:
+                carrier.content = self.merge([job.content for job in jobs])
+            except Exception as e:
+                log.error("Error merging jobs %s: %s", [job.id for job in jobs], e)
+                for job in jobs:
+                    self._dispatch(job.printer, [job])
+                return
+            for job in jobs[1:]:
+                job.merged_into = carrier.id
+                carrier.merged.append(job)
+            log.info(
+                "Merged %d jobs into %s", len(jobs), carrier.id,
+                extra={"job_id": carrier.id, "printer": carrier.printer, "merged": len(jobs)},
+            )
+        self._dispatch(carrier.printer, [carrier])
+
+    def priority_of(self, priority_class):
+        return self.priorities.get(priority_class, self.default_priority)
+
+    def _new_job(self, content, print_type, printer, priority):
+        job = PrintJob(
+            content, print_type, printer, self.priority_of(priority or print_type)
+        )
+        job.on_finish = self._finished
+        return job
+
+    def _finished(self, job):
+        self._release(job)
+        if self.journal is not None:
+            self.journal.finish(job)
+        if self.on_finish is not None:
+            self.on_finish(job)
+
+    def submit(self, content, print_type="customer", printer=None, priority=None):
+        """
+        Queue a print job and return it without waiting for the printer.
+        :param priority: Priority class, defaults to the print_type.
+        :raise QueueFull: The printer's queue is over its budget.
+        """
+        job = self._new_job(content, print_type, printer, priority)
+        self._admit([job])
+        if self.journal is not None:
+            # Only acknowledge jobs that will survive a crash
+            try:
+                self.journal.append([job])
+            except Exception:
+                self._release(job)
+                raise
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+        if self._hold([job]):
+            self._dispatch(printer, [job])
+        return job
+
+    def submit_batch(self, specs):
+        """
+        Queue several jobs at once. Jobs for the same printer are rendered
+        concurrently and sent to it in one document.
+        :param specs: List of (content, print_type, printer, priority) tuples,
+            priority being a class name or None for the print_type.
+        :return: The jobs, in the same order as specs.
+        :raise QueueFull: A printer's queue is over its budget, no job is queued.
+        :raise BatchTooLarge: The jobs for a printer are over its budget on
+            their own, no job is queued.
+        """
+        jobs = [
+            self._new_job(content, print_type, printer, priority)
+            for content, print_type, printer, priority in specs
+        ]
+        self._admit(jobs)
+        if self.journal is not None:
+            try:
+                self.journal.append(jobs)
+            except Exception:
+                for job in jobs:
+                    self._release(job)
+                raise
+        with self.lock:
+            for job in jobs:
+                self.jobs[job.id] = job
+            self._trim()
+        by_printer = OrderedDict()
+        for job in self._hold(jobs):
+            by_printer.setdefault(job.printer, []).append(job)
+        for printer, printer_jobs in by_printer.items():
+            self._dispatch(printer, printer_jobs)
+        return jobs
+
+    def replay(self):
+        """
+        Queue the jobs the journal has as unfinished, e.g. after a crash.
+        :return: The replayed jobs.
+        """
+        jobs = []
+        for entry in self.journal.unfinished():
+            job = PrintJob(
+                entry["content"], entry["print_type"], entry["printer"], entry["priority"]
+            )
+            job.id = entry["id"]
+            job.created_at = entry["created_at"]
+            job.on_finish = self._finished
+            jobs.append(job)
+        # Already accepted once, so they are counted but never refused
+        self._admit(jobs, check=False)
+        with self.lock:
+            for job in jobs:
+                self.jobs[job.id] = job
+            self._trim()
+        for job in jobs:
+            self._dispatch(job.printer, [job])
+        return jobs
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _trim(self):
+        # Forget the oldest finished jobs once we remember too many
+        excess = len(self.jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].finished.is_set():
+                del self.jobs[job_id]
+                excess -= 1
@@ -0,0 +1,203 @@
+import base64
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    print_type TEXT NOT NULL,
+    printer TEXT,
+    priority INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    finished_at REAL
+)
+"""
+FINISHED_STATES = ("done", "failed")
+
+log = logging.getLogger(__name__)
+
+
+def _dump_content(content):
+    # Binary image parts (see request_body.attach_parts) are stored as base64
+    lines = []
+    for line in content:
+        if isinstance(line, dict) and isinstance(line.get("blob"), (bytes, bytearray)):
+            line = dict(line, blob=base64.b64encode(line["blob"]).decode("ascii"))
+        lines.append(line)
+    return json.dumps(lines)
+
+
+def _load_content(text):
+    lines = json.loads(text)
+    for line in lines:
+        if isinstance(line, dict) and isinstance(line.get("blob"), str):
+            line["blob"] = base64.b64decode(line["blob"])
+    return lines
+
+
+class _Write:
+    """Statements committed together, and the result the caller may wait for"""
+
+    def __init__(self, statements, wait):
+        self.statements = statements
+        self.done = threading.Event() if wait else None
+        self.error = None
+
+
+class JobJournal:
+    """
+    Durable record of accepted print jobs in a SQLite database (WAL mode),
+    so jobs that weren't printed yet survive a crash or a reboot.
+
+    All writes go through one thread. Writes that arrive while a commit is
+    in progress are committed together in the next transaction (group
+    commit), so a burst of jobs costs a few fsyncs instead of one each.
+    """
+
+    def __init__(self, path, keep_seconds=3600, compact_interval=600):
+        """
+        :param path: SQLite database file.
+        :param keep_seconds: How long finished jobs are kept before compaction.
+        :param compact_interval: Seconds between compactions.
+        """
+        self.path = path
+        self.keep_seconds = keep_seconds
+        self.compact_interval = compact_interval
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Every commit is fsynced; group commit keeps their number low
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(SCHEMA)
+        self.db_lock = threading.Lock()
+        self.pending = []
+        self.has_pending = threading.Condition()
+        self.commits = 0
+        self.writes = 0
+        self.compact()
+        self.thread = threading.Thread(target=self._run, name="job-journal", daemon=True)
+        self.thread.start()
+
+    def _submit(self, statements, wait):
+        write = _Write(statements, wait)
+        with self.has_pending:
+            self.pending.append(write)
+            self.has_pending.notify()
+        if wait:
+            write.done.wait()
+            if write.error is not None:
+                raise write.error
+
+    def _run(self):
+        last_compaction = time.monotonic()
+        while True:
+            with self.has_pending:
+                if not self.pending:
+                    self.has_pending.wait(self.compact_interval)
+                batch, self.pending = self.pending, []
+            if batch:
+                self._commit(batch)
+            if time.monotonic() - last_compaction >= self.compact_interval:
+                last_compaction = time.monotonic()
+                try:
+                    self.compact()
+                except Exception as e:
+                    log.error("Error compacting the job journal: %s", e)
+
+    def _commit(self, batch):
+        error = None
+        with self.db_lock:
+            try:
+                self.conn.execute("BEGIN")
+                for write in batch:
+                    for sql, params in write.statements:
+                        self.conn.execute(sql, params)
+                self.conn.execute("COMMIT")
+                self.commits += 1
+                self.writes += len(batch)
+            except Exception as e:
+                log.error("Error writing the job journal: %s", e)
+                error = e
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+        for write in batch:
+            write.error = error
+            if write.done is not None:
+                write.done.set()
+
+    def append(self, jobs):
+        """Record newly accepted jobs, returning once they are on disk"""
+        self._submit(
+            [
+                (
+                    "INSERT OR REPLACE INTO jobs (id, created_at, print_type, printer,"
+                    " priority, content, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job.id,
+                        job.created_at,
+                        job.print_type,
+                        job.printer,
+                        job.priority,
+                        _dump_content(job.content),
+                        "queued",
+                    ),
+                )
+                for job in jobs
+            ],
+            wait=True,
+        )
+
+    def finish(self, job):
+        """Record that a job is done or failed, without waiting for the disk"""
+        self._submit(
+            [
+                (
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (job.status, job.error, time.time(), job.id),
+                )
+            ],
+            wait=False,
+        )
+
+    def unfinished(self):
+        """Jobs that were accepted but never finished, oldest first"""
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT id, created_at, print_type, printer, priority, content"
+                " FROM jobs WHERE status NOT IN (?, ?) ORDER BY created_at",
+                FINISHED_STATES,
+            ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "created_at": row[1],
+                "print_type": row[2],
+                "printer": row[3],
+                "priority": row[4],
+                "content": _load_content(row[5]),
+            }
+            for row in rows
+        ]
+
+    def compact(self):
+        """Forget old finished jobs and shrink the write-ahead log"""
+        cutoff = time.time() - self.keep_seconds
+        with self.db_lock:
+            self.conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                FINISHED_STATES + (cutoff,),
+            )
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def stats(self):
+        with self.db_lock:
+            counts = dict(
+                self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            )
+        return {"jobs": counts, "commits": self.commits, "writes": self.writes}
@@ -0,0 +1,146 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from collections import deque
+
+# LogRecord attributes that are not extra fields
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def record_fields(record):
+    """Fields passed with extra={...} on a log call"""
+    return {
+        key: value
+        for key, value in vars(record).items()
+        if key not in _RECORD_ATTRIBUTES and not key.startswith("_")
+    }
+
+
+def record_to_dict(record):
+    """Structured view of a log record: time, level, logger, message and fields"""
+    entry = {
+        "time": round(record.created, 3),
+        "level": record.levelname,
+        "logger": record.name,
+        "message": record.getMessage(),
+    }
+    entry.update(record_fields(record))
+    return entry
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        return json.dumps(record_to_dict(record), default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """The message followed by its fields, for reading in a console"""
+
+    def format(self, record):
+        fields = record_fields(record)
+        message = record.getMessage()
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent records in memory, for /debug/logs"""
+
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self.entries = deque(maxlen=capacity)
+        self.entries_lock = threading.Lock()
+
+    def emit(self, record):
+        entry = record_to_dict(record)
+        with self.entries_lock:
+            self.entries.append(entry)
+
+    def records(self, limit=100, level=None, **fields):
+        """
+        Most recent records first.
+        :param level: Minimum level name, e.g. "WARNING".
+        :param fields: Only records with these field values, e.g. job_id=...
+        """
+        minimum = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(minimum, int):
+            raise ValueError(f"Unknown log level '{level}'")
+        with self.entries_lock:
+            entries = list(self.entries)
+        matches = []
+        for entry in reversed(entries):
+            if logging.getLevelName(entry["level"]) < minimum:
+                continue
+            if any(str(entry.get(key)) != str(value) for key, value in fields.items()):
+                continue
+            matches.append(entry)
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+class LogPipeline:
+    """
+    Asynchronous logging: log calls only put the record on a queue, and a
+    background thread writes it to the console, the in-memory ring buffer
+    and (once add_file is called) a rotating JSON lines file. A slow console
+    or disk never holds up a print job.
+    """
+
+    def __init__(self, level="INFO", ring_size=1000, console=True):
+        """
+        :param level: Level of the root logger.
+        :param ring_size: Records kept in memory for /debug/logs.
+        :param console: Also write records to stderr.
+        """
+        self.level = level
+        self.queue = queue.SimpleQueue()
+        self.ring = RingBufferHandler(ring_size)
+        handlers = [self.ring]
+        if console:
+            stream = logging.StreamHandler()
+            stream.setFormatter(ConsoleFormatter())
+            handlers.append(stream)
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self.handler = logging.handlers.QueueHandler(self.queue)
+        self.started = False
+
+    def start(self):
+        """Route every logger through the queue and start the writer thread"""
+        if self.started:
+            return
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        self.started = True
+
+    def add_file(self, path, max_bytes=5 * 1024 * 1024, backups=5):
+        """Also write JSON lines to path, rotated at max_bytes"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True
+        )
+        handler.setFormatter(JsonFormatter())
+        # The writer thread reads the tuple for every record
+        self.listener.handlers = self.listener.handlers + (handler,)
+        return handler
+
+    def stop(self):
+        """Write out the queued records and stop the writer thread"""
+        if not self.started:
+            return
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        self.started = False
+
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class PrinterCache:
+    """
+    Remembers the installed printers and the default printer, which are
+    slow to enumerate on Windows when network printers are offline.
+    Stale data is served while a background thread refreshes it.
+    """
+
+    def __init__(self, enumerate, default=None, ttl=30, on_change=None):
+        """
+        :param enumerate: Callable returning the list of printer names.
+        :param default: Callable returning the default printer name, or None.
+        :param ttl: Seconds before the list is refreshed in the background.
+        :param on_change: Callable (old names or None, new names) called when
+            the list differs from the previous one, and on the first load.
+        """
+        self.enumerate = enumerate
+        self.default = default
+        self.ttl = ttl
+        self.on_change = on_change
+        self.printers = None
+        self.default_name = None
+        self.refreshed_at = None  # time.time() of the last refresh
+        self.changed_at = None
+        # Bumped whenever the printers or the default printer change
+        self.version = 0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def refresh(self):
+        """Enumerate the printers now and return the snapshot"""
+        printers = list(self.enumerate())
+        default_name = None
+        if self.default is not None:
+            try:
+                default_name = self.default()
+            except Exception as e:
+                log.error("Error getting the default printer: %s", e)
+        with self.lock:
+            old = self.printers
+            changed = old != printers or default_name != self.default_name
+            self.printers = printers
+            self.default_name = default_name
+            self.refreshed_at = time.time()
+            if changed:
+                self.changed_at = self.refreshed_at
+                self.version += 1
+        if changed and self.on_change is not None:
+            self.on_change(old, printers)
+        return self.snapshot()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            log.error("Error refreshing printers: %s", e)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def get(self):
+        """
+        Cached snapshot of the printers. Only the very first call waits for
+        the enumeration; afterwards an expired list is returned as is and
+        refreshed in the background.
+        """
+        with self.lock:
+            loaded = self.printers is not None
+            stale = loaded and time.time() - self.refreshed_at >= self.ttl
+            if stale and not self.refreshing:
+                self.refreshing = True
+                threading.Thread(
+                    target=self._refresh_in_background, name="printer-refresh", daemon=True
+                ).start()
+        if not loaded:
+            return self.refresh()
+        return self.snapshot()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "printers": list(self.printers or []),
+                "default": self.default_name,
+                "age": round(time.time() - self.refreshed_at, 3)
+                if self.refreshed_at
+                else None,
+                "refreshed_at": self.refreshed_at,
+                "changed_at": self.changed_at,
+                "version": self.version,
+            }
+
+    def default_printer(self):
+        """The default printer name from the cache"""
+        return self.get()["default"]
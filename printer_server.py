@@ -1,33 +1,44 @@
-from flask import Flask, request, jsonify
+import time
+
+STARTED_AT = time.perf_counter()  # For the startup report
+
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import os
-import win32print
-import win32api
-import tempfile
-import time
+import threading
 import base64
-from PIL import Image
+import json
+import logging
+import math
+import re
 from io import BytesIO
 
-import webbrowser
-import subprocess
+import atexit
 import sys
 
-
-def start_cloudflare_tunnel():
-    cloudflared_path = r"C:\Program Files\Cloudflare\bin\cloudflared.exe"
-    tunnel_name = "print-server-locale"
-
-    try:
-        subprocess.Popen(
-            [cloudflared_path, "tunnel", "run", tunnel_name],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
-        )
-        print("Cloudflare Tunnel started.")
-    except Exception as e:
-        print(f"Failed to start Cloudflare Tunnel: {e}")
+from assets import AssetStore, nv_define_command, nv_delete_command, nv_print_command
+from image_cache import RasterCache
+from job_queue import BatchTooLarge, JobManager, QueueFull
+from journal import JobJournal
+from log_pipeline import LogPipeline
+from metrics import MetricsRegistry
+from printer_cache import PrinterCache
+from profiling import Profiler
+from rate_limit import RateLimited, RateLimiter
+from request_body import (
+    BodyTooLarge,
+    UnsupportedEncoding,
+    attach_parts,
+    read_json,
+)
+from supervisor import ChildProcess, Supervisor
+from symbols import barcode_command, qr_command
+from text_encoding import TextEncoder
+from transports import DEFAULT_TRANSPORT, create_transport, win32print
+
+# Seconds from the start of the import to each startup milestone.
+# PIL and webbrowser are imported on first use to keep this short.
+startup_times = {"imports": time.perf_counter() - STARTED_AT}
 
 
 app = Flask(__name__)
@@ -36,396 +47,1393 @@ CORS(app)
 API_KEY = "your-secret-api-key"  # Store securely in production
 PRINTER_NAME = "POSPrinter POS80"  # Your printer name
 
-
-def validate_api_key(request):
-    """Validate the API key in the request"""
+# Which printer each print_type goes to; types not listed use PRINTER_NAME.
+# Every printer has its own queue and worker, so a slow kitchen printer
+# never holds up customer receipts.
+PRINTER_ROUTES = {
+    "customer": PRINTER_NAME,
+    "kitchen": PRINTER_NAME,
+}
+
+# Logical printers backed by several identical physical printers. Jobs go to
+# the member with the shortest queue; members that fail or report paper out
+# are taken out of rotation and their jobs rerouted. Route to the pool name,
+# e.g. PRINTER_ROUTES["kitchen"] = "Kitchen"
+#   "Kitchen": ["Kitchen Printer 1", "Kitchen Printer 2"],
+PRINTER_POOLS = {}
+PRINTER_HEALTH_INTERVAL = 5  # Seconds between status checks of pool members
+
+# Order in which queued jobs are printed, lower first. A request can pick a
+# class with "priority", otherwise its print_type is used. Jobs move up one
+# class for every PRIORITY_AGING_SECONDS they wait, so nothing starves.
+PRINT_PRIORITIES = {
+    "kitchen": 0,
+    "customer": 1,
+    "reprint": 2,
+    "test": 3,
+}
+DEFAULT_PRIORITY = 1
+PRIORITY_AGING_SECONDS = 30
+TEST_PRINT_TIMEOUT = 30  # Seconds /test-print waits for its queued job
+
+# Kitchen tickets for the same table arriving within this many seconds of
+# the first one are printed as one ticket with summed quantities, saving
+# cuts and paper at peak times. 0 prints every ticket right away.
+KITCHEN_COALESCE_SECONDS = 0
+
+# Optional "station" tags on a request (e.g. "bar", "grill") take
+# precedence over print_type, e.g. {"bar": "Bar Printer"}
+STATION_ROUTES = {}
+
+# How each printer is reached. Printers not listed here use the Windows
+# spooler (or the in-memory sink when not running on Windows). Examples:
+#   "Kitchen": {"type": "tcp", "host": "192.168.1.50", "port": 9100},
+#   "POSPrinter POS80": {"type": "sink", "path": "receipts.prn"},
+PRINTER_TRANSPORTS = {}
+
+# HTTP server. The production server (waitress) is used unless started with --dev
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 5000
+SERVER_THREADS = 8  # Requests handled at the same time
+SERVER_CONNECTION_LIMIT = 100  # Open connections, including idle keep-alive ones
+SERVER_CHANNEL_TIMEOUT = 120  # Seconds before an idle keep-alive connection is closed
+
+# Companion programs started and kept running next to the server
+NEXTJS_PATH = r"E:\chikenhut\chikenhutapp"  # None to not start the Next.js app
+NEXTJS_PORT = 3000
+NODE_SCRIPTS = [r"E:\chikenhut\sendReport", r"E:\chikenhut\dbbackup"]
+CLOUDFLARED_PATH = r"C:\Program Files\Cloudflare\bin\cloudflared.exe"
+CLOUDFLARE_TUNNEL = "print-server-locale"  # None to not start the tunnel
+CLOUDFLARED_METRICS_PORT = 20241  # cloudflared's /ready endpoint is served here
+
+# Limit on gzip/deflate compressed request bodies once decompressed
+MAX_DECOMPRESSED_BYTES = 16 * 1024 * 1024
+# Largest request body accepted as sent (mostly base64 logos). Checked against
+# Content-Length before anything is read or parsed.
+MAX_REQUEST_BYTES = 8 * 1024 * 1024
+
+# Budget of unfinished jobs and their content bytes per printer (or pool).
+# Beyond it /print answers 429 with a Retry-After estimated from how fast
+# the printer has been getting through its queue. None for no limit.
+PRINTER_QUEUE_MAX_JOBS = 200
+PRINTER_QUEUE_MAX_BYTES = 64 * 1024 * 1024
+
+# Requests per second per API key, allowing bursts of API_RATE_BURST.
+# None to not limit.
+API_RATE_LIMIT = 20
+API_RATE_BURST = 60
+
+PRINTER_CACHE_TTL = 30  # Seconds before the printer list is refreshed in the background
+
+IMAGE_MAX_WIDTH = 312  # 1.7 times larger than the original 180
+IMAGE_DITHER = "floyd-steinberg"  # or "none" for a hard threshold
+IMAGE_CACHE_BYTES = 8 * 1024 * 1024  # Budget for cached logo rasters
+
+# Non-ASCII text is printed in the first of these codepages (see
+# text_encoding.CODEPAGES) that has all of its characters. Lines none of
+# them can print, e.g. Bengali item names or the Taka sign, are drawn with
+# the first of TEXT_FONTS that loads (file names are also looked up in the
+# system font folder) and printed as bitmaps.
+TEXT_CODEPAGES = ["cp437", "cp858", "cp1252", "cp866", "cp852"]
+TEXT_FONTS = [
+    "Nirmala.ttf",  # Nirmala UI, ships with Windows 8 and later
+    "vrinda.ttf",
+    "NotoSansBengali-Regular.ttf",
+]
+TEXT_CACHE_BYTES = 2 * 1024 * 1024  # Budget for cached bitmap text lines
+PAPER_WIDTH_DOTS = 576  # Printable width of 80mm paper
+
+# Uploaded images (logos) live next to the script or the PyInstaller exe
+BASE_DIR = os.path.dirname(
+    sys.executable if getattr(sys, "frozen", False) else os.path.abspath(__file__)
+)
+ASSET_DIR = os.path.join(BASE_DIR, "assets")
+# Accepted jobs are recorded here until printed and replayed after a crash.
+# None to turn the journal off.
+JOURNAL_PATH = os.path.join(BASE_DIR, "print_journal.db")
+JOURNAL_KEEP_SECONDS = 3600  # Finished jobs are compacted away after this
+
+# Logging goes through a queue to a background thread, which writes the
+# console, the in-memory buffer behind /debug/logs and a rotating file of
+# JSON lines (when started as a script, None for no file)
+LOG_LEVEL = "INFO"
+LOG_PATH = os.path.join(BASE_DIR, "logs", "print_server.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_BUFFER_SIZE = 2000  # Recent records kept for /debug/logs
+
+log_pipeline = LogPipeline(LOG_LEVEL, LOG_BUFFER_SIZE)
+log_pipeline.start()
+# The writer thread is a daemon, write out what is still queued at exit.
+# Registered first, so it runs after the other exit handlers have logged.
+atexit.register(log_pipeline.stop)
+log = logging.getLogger("print_server")
+
+
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+
+rate_limiter = RateLimiter(API_RATE_LIMIT, API_RATE_BURST) if API_RATE_LIMIT else None
+
+
+def validate_api_key(request, rate_limited=False):
+    """
+    Validate the API key in the request.
+    :param rate_limited: Also count the request against the key's rate
+        limit, raising RateLimited when it is over. Set on the routes that
+        accept new work, not on status polling like /jobs/<job_id>.
+    """
     api_key = request.headers.get("X-API-KEY")
-    return api_key == API_KEY
+    if api_key != API_KEY:
+        return False
+    if rate_limited and rate_limiter is not None:
+        wait = rate_limiter.acquire(api_key)
+        if wait:
+            raise RateLimited(wait)
+    return True
+
+
+def enumerate_printers():
+    """List all available printers in Windows plus the configured network/sink printers"""
+    names = []
+    if win32print is not None:
+        printers = win32print.EnumPrinters(win32print.PRINTER_ENUM_LOCAL, None, 2)
+        names = [p["pPrinterName"] for p in printers]
+    names += [name for name in PRINTER_TRANSPORTS if name not in names]
+    return names
+
+
+def default_windows_printer():
+    return win32print.GetDefaultPrinter() if win32print is not None else None
+
+
+def report_printer_change(old, new):
+    """Print the list once, then only what was added or removed"""
+    if old is None:
+        log.info(
+            "Available printers:\n" + "\n".join(f" - {name}" for name in new),
+            extra={"printers": new},
+        )
+        return
+    for name in new:
+        if name not in old:
+            log.info("Printer added: %s", name, extra={"printer": name})
+    for name in old:
+        if name not in new:
+            log.info("Printer removed: %s", name, extra={"printer": name})
+
+
+printer_cache = PrinterCache(
+    enumerate_printers,
+    default=default_windows_printer,
+    ttl=PRINTER_CACHE_TTL,
+    on_change=report_printer_change,
+)
 
 
 def list_printers():
-    """List all available printers in Windows"""
-    printers = win32print.EnumPrinters(win32print.PRINTER_ENUM_LOCAL, None, 2)
-    print("\nAvailable Printers:")
-    for printer in printers:
-        print(f" - {printer['pPrinterName']}")
-    return [p["pPrinterName"] for p in printers]
+    """Names of the available printers, from the cache"""
+    return printer_cache.get()["printers"]
+
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(
+    "print_server_request_seconds",
+    "Time spent handling HTTP requests",
+    ("endpoint", "method", "status"),
+)
+render_seconds = metrics.histogram(
+    "print_server_render_seconds",
+    "Time spent rendering jobs to ESC/POS commands",
+    ("print_type",),
+)
+image_seconds = metrics.histogram(
+    "print_server_image_seconds",
+    "Time spent turning base64 images into raster commands",
+    ("cache",),
+)
+transport_seconds = metrics.histogram(
+    "print_server_transport_write_seconds",
+    "Time spent writing jobs to the spooler or printer",
+    ("printer", "outcome"),
+)
+queue_seconds = metrics.histogram(
+    "print_server_job_queue_seconds",
+    "Time jobs waited in the queue before rendering started",
+    ("printer",),
+)
+jobs_total = metrics.counter(
+    "print_server_jobs_total",
+    "Finished print jobs",
+    ("print_type", "printer", "outcome"),
+)
+bytes_sent_total = metrics.counter(
+    "print_server_bytes_sent_total",
+    "ESC/POS bytes sent to each printer",
+    ("printer",),
+)
+metrics.gauge(
+    "print_server_queue_depth",
+    "Jobs waiting for each printer or pool",
+    ("printer",),
+    callback=lambda: {(name,): depth for name, depth in job_manager.queue_depths().items()},
+)
+requests_rejected_total = metrics.counter(
+    "print_server_requests_rejected_total",
+    "Requests turned away by the rate limit, queue budgets or body size limit",
+    ("reason",),
+)
+metrics.gauge(
+    "print_server_queue_bytes",
+    "Content bytes of unfinished jobs counted against each printer's budget",
+    ("printer",),
+    callback=lambda: {
+        (name,): backlog["bytes"] for name, backlog in job_manager.backlogs().items()
+    },
+)
+metrics.gauge(
+    "print_server_startup_seconds",
+    "Seconds after the start of the import that each startup phase was reached",
+    ("phase",),
+    callback=lambda: {(phase,): seconds for phase, seconds in startup_times.items()},
+)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if "first_request" not in startup_times:
+        startup_times["first_request"] = g.request_start - STARTED_AT
+        log.info(
+            "Startup: "
+            + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in startup_times.items())
+        )
+
+
+def too_many_requests(message, retry_after, reason):
+    """429 response telling the client when to try again"""
+    requests_rejected_total.inc(reason=reason)
+    response = jsonify({"error": message, "retry_after": math.ceil(retry_after)})
+    response.headers["Retry-After"] = str(max(math.ceil(retry_after), 1))
+    return response, 429
+
+
+@app.errorhandler(RateLimited)
+def handle_rate_limited(e):
+    return too_many_requests("Too many requests", e.retry_after, "rate_limit")
+
+
+@app.errorhandler(413)
+def handle_too_large(e):
+    requests_rejected_total.inc(reason="too_large")
+    return jsonify({"error": f"Request body is larger than {MAX_REQUEST_BYTES} bytes"}), 413
+
+
+@app.after_request
+def record_request_time(response):
+    start = g.get("request_start")
+    if start is not None:
+        # The route pattern, not the path, so /jobs/<job_id> is one series
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        request_seconds.observe(
+            time.perf_counter() - start,
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+
+# ESC/POS command bytes
+ESC = bytes([0x1B])  # Escape
+GS = bytes([0x1D])  # Group Separator
+SMALL_FONT = ESC + b"M" + b"\x01"  # Font B (small)
+NORMAL_FONT = ESC + b"M" + b"\x00"  # Font A (normal)
+
+INIT = ESC + b"@"  # Initialize printer
+CENTER = ESC + b"a" + bytes([0x01])  # Center align
+LEFT = ESC + b"a" + bytes([0x00])  # Left align
+RIGHT = ESC + b"a" + bytes([0x02])  # Right align
+BOLD_ON = ESC + b"E" + bytes([0x01])  # Bold on
+BOLD_OFF = ESC + b"E" + bytes([0x00])  # Bold off
+DOUBLE_HW = ESC + b"!" + bytes([0x30])  # Double height & width
+DOUBLE_OFF = ESC + b"!" + bytes([0x00])  # Normal size
+QUAD_SIZE = (
+    ESC + b"!" + bytes([0x38])
+)  # Quadruple size (double width + double height + emphasized)
+CUT = GS + b"V" + bytes([0x41]) + bytes([0x03])  # Cut paper with feed
+
+
+class LayoutProfile:
+    """Column widths and separators of a receipt layout, computed once"""
+
+    def __init__(self, col_widths=(5, 22, 5, 5, 8), total_rule_width=45):
+        self.col_widths = tuple(col_widths)  # No, Name, Qty, Rate, Total
+        self.line_width = sum(self.col_widths)
+        # Label column of subtotal/discount lines, amounts get the last 8
+        self.label_width = self.line_width - 8
+        self.separator = b"-" * self.line_width + b"\n"
+        self.total_rule = b"-" * total_rule_width + b"\n"
+
+
+LAYOUT_PROFILES = {
+    "customer": LayoutProfile(),
+}
+
+# Printed after the last line of each print type
+RECEIPT_FOOTERS = {
+    "customer": CENTER + b"\nThank you for your purchase!\n\n" + CUT,
+    # Minimal feed and cut
+    "kitchen": b"\n" + CUT,
+}
+
+
+class RenderContext:
+    """State shared by the line handlers while rendering one receipt"""
 
+    def __init__(self, print_type, printer_name, layout):
+        self.print_type = print_type
+        self.printer_name = printer_name
+        self.layout = layout
+        self.commands = bytearray(INIT)
+        # Set after a table row; the separator is written once the table ends
+        self.table_open = False
+        # Codepage selected with ESC t, None for the printer's default
+        self.codepage = None
 
-def generate_esc_pos_commands(content, print_type="customer"):
+    def text(self, text, scale=1, small=False):
+        """
+        Append text. Non-ASCII text goes through text_encoder, which picks
+        a codepage or falls back to a bitmap (drawn scale times larger, or
+        in the Font B size when small).
+        """
+        if text.isascii():
+            self.commands.extend(text.encode())
+            return
+        data, self.codepage = text_encoder.encode(text, self.codepage, scale, small)
+        self.commands.extend(data)
+
+
+# print_type -> line type -> handler(ctx, line). The None entry handles
+# lines whose type has no handler of its own.
+LINE_HANDLERS = {"customer": {}, "kitchen": {}}
+
+
+def line_handler(print_type, *line_types):
+    """Register a function as the handler of one or more line types"""
+
+    def register(func):
+        for line_type in line_types:
+            LINE_HANDLERS[print_type][line_type] = func
+        return func
+
+    return register
+
+
+def receipt_kind(print_type):
+    """Anything that isn't a kitchen ticket prints as a customer receipt"""
+    return "kitchen" if print_type == "kitchen" else "customer"
+
+
+def generate_esc_pos_commands(content, print_type="customer", printer_name=None):
     """Generate ESC/POS commands for receipt or kitchen order"""
-    ESC = bytes([0x1B])  # Escape
-    GS = bytes([0x1D])  # Group Separator
-    SMALL_FONT = ESC + b"M" + b"\x01"  # Font B (small)
-    NORMAL_FONT = ESC + b"M" + b"\x00"  # Font A (normal)
-
-    INIT = ESC + b"@"  # Initialize printer
-    CENTER = ESC + b"a" + bytes([0x01])  # Center align
-    LEFT = ESC + b"a" + bytes([0x00])  # Left align
-    RIGHT = ESC + b"a" + bytes([0x02])  # Right align
-    BOLD_ON = ESC + b"E" + bytes([0x01])  # Bold on
-    BOLD_OFF = ESC + b"E" + bytes([0x00])  # Bold off
-    DOUBLE_HW = ESC + b"!" + bytes([0x30])  # Double height & width
-    DOUBLE_OFF = ESC + b"!" + bytes([0x00])  # Normal size
-    QUAD_SIZE = (
-        ESC + b"!" + bytes([0x38])
-    )  # Quadruple size (double width + double height + emphasized)
-    CUT = GS + b"V" + bytes([0x41]) + bytes([0x03])  # Cut paper with feed
-
-    commands = bytearray()
-    commands.extend(INIT)
-
-    if print_type == "kitchen":
-        # Kitchen print: compact, big font for items and table, only time/date, table, items
-        for line in content:
-            if line.get("type") == "header":
-                commands.extend(CENTER)
-                commands.extend(BOLD_ON)
-                commands.extend(f"{line.get('text')}\n".encode())
-                commands.extend(BOLD_OFF)
-                commands.extend(LEFT)
-            elif line.get("type") == "text":
-                # Make table line big
-                if "table" in line.get("text", "").lower():
-                    commands.extend(QUAD_SIZE)
-                    commands.extend(f"{line.get('text')}\n".encode())
-                    commands.extend(DOUBLE_OFF)
-                else:
-                    commands.extend(f"{line.get('text')}\n".encode())
-            elif line.get("type") == "item" or (
-                line.get("name") and line.get("quantity")
-            ):
-                # Use quadruple size for items
-                commands.extend(QUAD_SIZE)
-                name = line.get("name", line.get("text", ""))
-                qty = line.get("quantity", 1)
-                commands.extend(f"{name} {qty}\n".encode())
-                commands.extend(DOUBLE_OFF)
-        # Minimal feed and cut
-        commands.extend(b"\n" + CUT)
-        return commands
-
-    # Default: customer print (existing logic)
-    for idx, line in enumerate(content):
-        if line.get("type") == "image":
-            image_data = line.get("data", "")
-            if image_data:
-                try:
-                    img_commands = process_image(image_data)
-                    if img_commands:
-                        commands.extend(CENTER)
-                        commands.extend(img_commands)
-                        commands.extend(LEFT)
-                        commands.extend(b"\n")
-                except Exception as e:
-                    print(f"Error processing image: {e}")
-        elif line.get("type") == "header":
-            commands.extend(CENTER)
-            commands.extend(BOLD_ON)
-            commands.extend(f"{line.get('text')}\n".encode())
-            commands.extend(BOLD_OFF)
-            commands.extend(LEFT)
-        elif line.get("type") == "address":
-            commands.extend(SMALL_FONT)
-            commands.extend(LEFT)
-            commands.extend(f"{line.get('text')}\n".encode())
-            commands.extend(NORMAL_FONT)
-        elif line.get("type") == "phone":
-            commands.extend(SMALL_FONT)
-            commands.extend(LEFT)
-            commands.extend(f"{line.get('text')}\n".encode())
-            commands.extend(NORMAL_FONT)
-            commands.extend(b"\n")
-        elif line.get("type") == "table-header":
-            columns = line.get("columns", [])
-            # Improved column widths with better spacing
-            col_widths = [5, 22, 5, 5, 8]  # No, Name, Qty, Rate, Total
-
-            # Create header with proper spacing
-            header_parts = []
-            for i, (col, w) in enumerate(zip(columns, col_widths)):
-                if i == 0:  # No column
-                    header_parts.append(str(col)[:w].ljust(w))
-                elif i == 1:  # Name column (left aligned)
-                    header_parts.append(str(col)[:w].ljust(w))
-                else:  # Qty, Rate, Total (right aligned)
-                    header_parts.append(str(col)[:w].rjust(w))
-
-            header = "".join(header_parts)
-            commands.extend(LEFT)  # Use left alignment instead of center
-            commands.extend(header.encode() + b"\n")
-
-            # Create separator line with proper width
-            separator = "-" * sum(col_widths)
-            commands.extend(separator.encode() + b"\n")
-        elif line.get("type") == "table-row":
-            columns = line.get("columns", [])
-            # Match the improved column widths from the header
-            col_widths = [5, 22, 5, 5, 8]
-
-            # Format each column in the row with proper alignment
-            row_parts = []
-            for i, (col, w) in enumerate(zip(columns, col_widths)):
-                col_str = str(col)
-                # Convert numeric values to integers if possible
-                if (
-                    i != 1 and col_str.replace(".", "", 1).isdigit()
-                ):  # Skip the name column
-                    try:
-                        col_str = str(int(float(col)))
-                    except:
-                        pass
-
-                if i == 0:  # No column (left aligned)
-                    row_parts.append(col_str[:w].ljust(w))
-                elif i == 1:  # Name column (left aligned)
-                    row_parts.append(col_str[:w].ljust(w))
-                else:  # Qty, Rate, Total (right aligned)
-                    row_parts.append(col_str[:w].rjust(w))
-
-            row = "".join(row_parts)
-            commands.extend(LEFT)  # Use left alignment instead of center
-            commands.extend(row.encode() + b"\n")
-            # If next line is not a table-row, print separator
-            next_line = content[idx + 1] if idx + 1 < len(content) else None
-            if not (next_line and next_line.get("type") == "table-row"):
-                separator = "-" * sum(col_widths)
-                commands.extend(separator.encode() + b"\n")
-        elif line.get("type") == "discount":
-            label = line.get("label", "Discount")
-            amount = line.get("amount", "")
-            try:
-                amount_str = (
-                    f"-{int(float(amount.replace('-', '')))}"
-                    if "-" in amount
-                    else str(int(float(amount)))
-                )
-            except:
-                amount_str = amount
-
-            # Align with the column layout
-            total_width = sum([5, 22, 5, 5, 8])  # Sum of all column widths
-            discount_line = f"{label:<{total_width-8}}{amount_str:>8}\n"
-            commands.extend(discount_line.encode())
-        elif line.get("type") == "subtotal":
-            label = line.get("label", "Sub-total")
-            amount = line.get("amount", "")
-            try:
-                amount_str = "Tk." + str(int(float(amount)))
-            except:
-                amount_str = amount
-
-            # Align with the column layout
-            total_width = sum([5, 22, 5, 5, 8])  # Sum of all column widths
-            subtotal_line = f"{label:<{total_width-8}}{amount_str:>8}\n"
-            commands.extend(subtotal_line.encode())
-            commands.extend(b"\n")
-        elif line.get("type") == "item":
-            name = line.get("name", "")
-            quantity = int(float(line.get("quantity", 1)))
-            price = int(float(line.get("price", 0)))
-            total = quantity * price
-
-            # Format with better spacing to mimic the table structure
-            no_col_width = 5
-            name_col_width = 22
-            qty_col_width = 5
-            rate_col_width = 5
-            total_col_width = 8
-
-            # Left align the item name/number, right align the numeric values
-            item_text = f"{name:<{name_col_width+no_col_width}}x{quantity:>{qty_col_width}}  {price:>{rate_col_width}}  {total:>{total_col_width}}\n"
-            commands.extend(item_text.encode())
-        elif line.get("type") == "total":
-            commands.extend(("-" * 45).encode() + b"\n")  # Consistent separator width
-            commands.extend(RIGHT)
-            amount = int(float(line.get("amount", 0)))
-            commands.extend(f"TOTAL: tk.{amount}\n".encode())
-            commands.extend(("-" * 45).encode() + b"\n")  # Consistent separator width
-            commands.extend(LEFT)
-        elif line.get("type") == "text":
-            align = line.get("align", "left")
-            if align == "left":
-                commands.extend(LEFT)
-            elif align == "center":
-                commands.extend(CENTER)
-            elif align == "right":
-                commands.extend(RIGHT)
-            commands.extend(f"{line.get('text')}\n".encode())
-            commands.extend(LEFT)  # Reset to left after
-        elif line.get("text"):
-            commands.extend(f"{line.get('text')}\n".encode())
-    commands.extend(CENTER)
-    commands.extend("\nThank you for your purchase!\n\n".encode())
-    commands.extend(CUT)
+    print_type = receipt_kind(print_type)
+    handlers = LINE_HANDLERS[print_type]
+    fallback = handlers.get(None)
+    ctx = RenderContext(print_type, printer_name, LAYOUT_PROFILES["customer"])
+    commands = ctx.commands
+
+    for line in content:
+        line_type = line.get("type")
+        if ctx.table_open and line_type != "table-row":
+            commands.extend(ctx.layout.separator)
+            ctx.table_open = False
+        handler = handlers.get(line_type, fallback)
+        if handler is not None:
+            handler(ctx, line)
+
+    if ctx.table_open:
+        commands.extend(ctx.layout.separator)
+    commands.extend(RECEIPT_FOOTERS[print_type])
     return commands
 
 
-def process_image(base64_data):
+# Kitchen print: compact, big font for items and table, only time/date, table, items
+
+
+@line_handler("kitchen", "header")
+def kitchen_header(ctx, line):
+    ctx.commands.extend(CENTER + BOLD_ON)
+    ctx.text(f"{line.get('text')}\n")
+    ctx.commands.extend(BOLD_OFF + LEFT)
+
+
+@line_handler("kitchen", "text")
+def kitchen_text(ctx, line):
+    # Make table line big
+    if "table" in line.get("text", "").lower():
+        ctx.commands.extend(QUAD_SIZE)
+        ctx.text(f"{line.get('text')}\n", scale=2)
+        ctx.commands.extend(DOUBLE_OFF)
+    else:
+        ctx.text(f"{line.get('text')}\n")
+
+
+@line_handler("kitchen", "item", None)
+def kitchen_item(ctx, line):
+    # Untyped lines with a name and quantity are items too
+    if line.get("type") != "item" and not (line.get("name") and line.get("quantity")):
+        return
+    # Use quadruple size for items
+    name = line.get("name", line.get("text", ""))
+    qty = line.get("quantity", 1)
+    ctx.commands.extend(QUAD_SIZE)
+    ctx.text(f"{name} {qty}\n", scale=2)
+    ctx.commands.extend(DOUBLE_OFF)
+
+
+def is_kitchen_item(line):
+    """Whether kitchen_item prints the line"""
+    line_type = line.get("type")
+    if line_type == "item":
+        return True
+    return line_type not in LINE_HANDLERS["kitchen"] and bool(
+        line.get("name") and line.get("quantity")
+    )
+
+
+# A line holding only a date and/or time, e.g. "Time: 12:05 PM"
+_DATE_TIME_LINE = re.compile(
+    r"(?:(?:date|time)\s*[:&]?\s*)*(?=.*\d)[\d\s:/.,-]*(?:[ap]\.?m\.?)?", re.IGNORECASE
+)
+
+
+def kitchen_table(job):
+    """Coalescing key of a kitchen job: its printer and table line"""
+    if job.print_type != "kitchen":
+        return None
+    for line in job.content:
+        if not isinstance(line, dict) or line.get("type") not in ("text", None):
+            continue
+        text = " ".join(str(line.get("text") or "").split())
+        if "table" in text.lower() and not is_kitchen_item(line):
+            return job.printer, text.lower()
+    return None
+
+
+def plain_kitchen_ticket(job):
     """
-    Process base64 image and convert to ESC/POS printer format
-    For thermal printers, we need to convert images to monochrome bitmap
+    Whether a kitchen job may be merged: only tickets made of items, header
+    lines, the table line and date/time lines are. Anything else (e.g. a
+    note about allergies) could be lost or end up under another ticket's
+    items, so those print on their own.
     """
+    table = None
+    for line in job.content:
+        if not isinstance(line, dict):
+            return False
+        if is_kitchen_item(line) or line.get("type") == "header":
+            continue
+        if line.get("type") not in ("text", None):
+            return False
+        text = " ".join(str(line.get("text") or "").split())
+        if not text or _DATE_TIME_LINE.fullmatch(text):
+            continue
+        if table is None and "table" in text.lower():
+            table = text
+            continue
+        return False
+    return True
+
+
+def merge_kitchen_tickets(contents):
+    """
+    Merge kitchen tickets of one table into one: the first ticket's header,
+    time and table lines, with the items of all tickets in place of its
+    items. Identical items have their quantities summed. Only called for
+    tickets plain_kitchen_ticket accepted, so no other lines are dropped.
+    """
+    items = {}
+    for content in contents:
+        for line in content:
+            if not is_kitchen_item(line):
+                continue
+            try:
+                quantity = float(line.get("quantity", 1))
+            except (TypeError, ValueError):
+                # Can't be added up, keep the line as it is
+                items[id(line)] = dict(line)
+                continue
+            key = tuple(sorted((k, str(v)) for k, v in line.items() if k != "quantity"))
+            if key in items:
+                items[key]["quantity"] += quantity
+            else:
+                items[key] = dict(line, quantity=quantity)
+    for line in items.values():
+        if isinstance(line["quantity"], float) and line["quantity"].is_integer():
+            line["quantity"] = int(line["quantity"])
+
+    merged = []
+    for line in contents[0]:
+        if not is_kitchen_item(line):
+            merged.append(line)
+        elif items:
+            merged.extend(items.values())
+            items = {}
+    merged.extend(items.values())
+    return merged
+
+
+# Customer print
+
+
+@line_handler("customer", "image")
+def customer_image(ctx, line):
+    image_data = line.get("data", "")
+    image_ref = line.get("ref")
+    # Bytes of a multipart part, see attach_parts
+    image_blob = line.get("blob")
+    if not (image_data or image_ref or image_blob):
+        return
     try:
-        # Commands for bitmap printing
-        GS = bytes([0x1D])
-
-        # Parse the base64 data
-        if "base64," in base64_data:
-            # Handle data URLs like "data:image/png;base64,..."
-            base64_data = base64_data.split("base64,")[1]
-
-        # Decode base64 data
-        image_data = base64.b64decode(base64_data)
-
-        # Open the image using PIL
-        img = Image.open(BytesIO(image_data))
-
-        # If image has alpha channel, paste it on white background
-        if img.mode in ("RGBA", "LA"):
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[-1])  # Use alpha channel as mask
-            img = background
-
-        # Resize image if too large - make logo smaller
-        max_width = 312  # 1.7 times larger than the original 180
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.LANCZOS)
-
-        # Convert to black and white (1-bit)
-        img = img.convert("1")
-
-        # Get image dimensions
-        width, height = img.size
-
-        # Calculate bytes per line (width / 8, rounded up)
-        bytes_per_line = (width + 7) // 8
-
-        # ESC/POS GS v 0 command for printing bitmap
-        # Format: GS v 0 m xL xH yL yH d1...dk
-        # m=0: normal mode
-        # xL, xH: width in bytes as lower and upper byte
-        # yL, yH: height in pixels as lower and upper byte
-        command = bytearray(
-            GS
-            + b"v0"
-            + bytes(
-                [
-                    0,
-                    bytes_per_line & 0xFF,
-                    (bytes_per_line >> 8) & 0xFF,
-                    height & 0xFF,
-                    (height >> 8) & 0xFF,
-                ]
+        if image_ref:
+            img_commands = image_ref_commands(image_ref, ctx.printer_name)
+        elif image_blob:
+            img_commands = process_image_bytes(
+                image_blob,
+                max_width=line.get("max_width", IMAGE_MAX_WIDTH),
+                dither=line.get("dither", IMAGE_DITHER),
+            )
+        else:
+            img_commands = process_image(
+                image_data,
+                max_width=line.get("max_width", IMAGE_MAX_WIDTH),
+                dither=line.get("dither", IMAGE_DITHER),
             )
+        if img_commands:
+            ctx.commands.extend(CENTER)
+            ctx.commands.extend(img_commands)
+            ctx.commands.extend(LEFT + b"\n")
+    except Exception as e:
+        log.warning("Error processing image: %s", e)
+
+
+@line_handler("customer", "qrcode")
+@line_handler("kitchen", "qrcode")
+def qrcode_line(ctx, line):
+    # The printer draws the symbol, so only the data is sent, not a bitmap
+    try:
+        command = qr_command(
+            line.get("data", ""),
+            size=line.get("size", 6),
+            error_correction=line.get("error_correction", "M"),
         )
+    except (TypeError, ValueError) as e:
+        # Like a broken image, skip the line rather than fail the receipt
+        log.warning("Error processing QR code: %s", e)
+        return
+    ctx.commands.extend(TEXT_ALIGN.get(line.get("align", "center"), CENTER))
+    ctx.commands.extend(command)
+    ctx.commands.extend(LEFT + b"\n")
+
+
+@line_handler("customer", "barcode")
+@line_handler("kitchen", "barcode")
+def barcode_line(ctx, line):
+    try:
+        command = barcode_command(
+            line.get("data", ""),
+            symbology=line.get("symbology", "CODE128"),
+            height=line.get("height", 80),
+            width=line.get("width", 2),
+            hri=line.get("hri", "below"),
+            hri_font=line.get("hri_font", "A"),
+        )
+    except (TypeError, ValueError) as e:
+        log.warning("Error processing barcode: %s", e)
+        return
+    ctx.commands.extend(TEXT_ALIGN.get(line.get("align", "center"), CENTER))
+    ctx.commands.extend(command)
+    ctx.commands.extend(LEFT + b"\n")
+
+
+@line_handler("customer", "header")
+def customer_header(ctx, line):
+    ctx.commands.extend(CENTER + BOLD_ON)
+    ctx.text(f"{line.get('text')}\n")
+    ctx.commands.extend(BOLD_OFF + LEFT)
+
+
+@line_handler("customer", "address")
+def customer_address(ctx, line):
+    ctx.commands.extend(SMALL_FONT + LEFT)
+    ctx.text(f"{line.get('text')}\n", small=True)
+    ctx.commands.extend(NORMAL_FONT)
+
+
+@line_handler("customer", "phone")
+def customer_phone(ctx, line):
+    ctx.commands.extend(SMALL_FONT + LEFT)
+    ctx.text(f"{line.get('text')}\n", small=True)
+    ctx.commands.extend(NORMAL_FONT + b"\n")
+
+
+@line_handler("customer", "table-header")
+def customer_table_header(ctx, line):
+    columns = line.get("columns", [])
+    header_parts = []
+    for i, (col, w) in enumerate(zip(columns, ctx.layout.col_widths)):
+        if i < 2:  # No and Name columns (left aligned)
+            header_parts.append(str(col)[:w].ljust(w))
+        else:  # Qty, Rate, Total (right aligned)
+            header_parts.append(str(col)[:w].rjust(w))
+    ctx.commands.extend(LEFT)
+    ctx.text("".join(header_parts) + "\n")
+    ctx.commands.extend(ctx.layout.separator)
+
+
+@line_handler("customer", "table-row")
+def customer_table_row(ctx, line):
+    columns = line.get("columns", [])
+    row_parts = []
+    for i, (col, w) in enumerate(zip(columns, ctx.layout.col_widths)):
+        col_str = str(col)
+        # Convert numeric values to integers if possible (skip the name column)
+        if i != 1 and col_str.replace(".", "", 1).isdigit():
+            try:
+                col_str = str(int(float(col)))
+            except Exception:
+                pass
+        if i < 2:  # No and Name columns (left aligned)
+            row_parts.append(col_str[:w].ljust(w))
+        else:  # Qty, Rate, Total (right aligned)
+            row_parts.append(col_str[:w].rjust(w))
+    ctx.commands.extend(LEFT)
+    ctx.text("".join(row_parts) + "\n")
+    ctx.table_open = True
+
+
+@line_handler("customer", "discount")
+def customer_discount(ctx, line):
+    label = line.get("label", "Discount")
+    amount = line.get("amount", "")
+    try:
+        amount_str = (
+            f"-{int(float(amount.replace('-', '')))}"
+            if "-" in amount
+            else str(int(float(amount)))
+        )
+    except Exception:
+        amount_str = amount
+    width = ctx.layout.label_width
+    ctx.text(f"{label:<{width}}{amount_str:>8}\n")
+
+
+@line_handler("customer", "subtotal")
+def customer_subtotal(ctx, line):
+    label = line.get("label", "Sub-total")
+    amount = line.get("amount", "")
+    try:
+        amount_str = "Tk." + str(int(float(amount)))
+    except Exception:
+        amount_str = amount
+    width = ctx.layout.label_width
+    ctx.text(f"{label:<{width}}{amount_str:>8}\n\n")
+
+
+@line_handler("customer", "item")
+def customer_item(ctx, line):
+    name = line.get("name", "")
+    quantity = int(float(line.get("quantity", 1)))
+    price = int(float(line.get("price", 0)))
+    total = quantity * price
+    no_w, name_w, qty_w, rate_w, total_w = ctx.layout.col_widths
+    # Left align the item name/number, right align the numeric values
+    ctx.text(
+        f"{name:<{name_w + no_w}}x{quantity:>{qty_w}}  {price:>{rate_w}}  {total:>{total_w}}\n"
+    )
+
+
+@line_handler("customer", "total")
+def customer_total(ctx, line):
+    amount = int(float(line.get("amount", 0)))
+    ctx.commands.extend(ctx.layout.total_rule + RIGHT)
+    ctx.text(f"TOTAL: tk.{amount}\n")
+    ctx.commands.extend(ctx.layout.total_rule + LEFT)
+
+
+TEXT_ALIGN = {"left": LEFT, "center": CENTER, "right": RIGHT}
+
+
+@line_handler("customer", "text")
+def customer_text(ctx, line):
+    ctx.commands.extend(TEXT_ALIGN.get(line.get("align", "left"), b""))
+    ctx.text(f"{line.get('text')}\n")
+    ctx.commands.extend(LEFT)  # Reset to left after
+
+
+@line_handler("customer", None)
+def customer_plain_text(ctx, line):
+    if line.get("text"):
+        ctx.text(f"{line.get('text')}\n")
+
+
+# Maps every byte to its bitwise inverse
+_INVERT_TABLE = bytes(255 - i for i in range(256))
+
+
+def pack_raster(img):
+    """
+    Pack a 1-bit PIL image into GS v 0 raster data.
+    PIL already stores mode "1" images as packed rows (MSB first, rows padded
+    to whole bytes) but with 1 for white, while ESC/POS wants 1 for black,
+    so the bytes only need inverting. Padding bits must end up white (0),
+    which is why narrow images are pasted onto a white canvas first.
+    """
+    from PIL import Image
+
+    width, height = img.size
+    if width % 8:
+        padded = Image.new("1", (((width + 7) // 8) * 8, height), 1)
+        padded.paste(img, (0, 0))
+        img = padded
+    return img.tobytes().translate(_INVERT_TABLE)
+
 
-        # Convert image to bitmap data
-        pixels = list(img.getdata())
+# Names of the PIL Image.Dither members, looked up once PIL is imported
+DITHER_MODES = {
+    "floyd-steinberg": "FLOYDSTEINBERG",
+    "none": "NONE",
+}
 
-        # Process each row of the image
-        for y in range(height):
-            for x in range(0, width, 8):
-                # Process 8 pixels at a time (1 byte)
-                byte_val = 0
+# Rasterized images keyed by payload hash and render parameters
+image_cache = RasterCache(IMAGE_CACHE_BYTES)
 
-                # For each of the 8 bits in this byte
-                for bit in range(8):
-                    # Make sure we don't go past the width of the image
-                    if x + bit < width:
-                        # Get pixel value (0 for black, 1 for white in mode "1")
-                        # For ESC/POS, we need to invert: 1 for black, 0 for white
-                        pixel = pixels[y * width + x + bit]
-                        if pixel == 0:  # Black pixel
-                            byte_val |= 1 << (7 - bit)
 
-                # Add the byte to the command
-                command.append(byte_val)
+def process_image(base64_data, max_width=IMAGE_MAX_WIDTH, dither=IMAGE_DITHER):
+    """
+    Process base64 image and convert to ESC/POS printer format
+    For thermal printers, we need to convert images to monochrome bitmap
+    Results are cached, so a logo sent on every receipt is only rendered once
+    """
+    return _cached_raster(base64_data, max_width, dither, encoded=True)
+
 
+def process_image_bytes(image_data, max_width=IMAGE_MAX_WIDTH, dither=IMAGE_DITHER):
+    """Same as process_image for raw image bytes, e.g. a multipart upload"""
+    return _cached_raster(image_data, max_width, dither, encoded=False)
+
+
+def _cached_raster(payload, max_width, dither, encoded):
+    start = time.perf_counter()
+    cache = "error"
+    try:
+        if encoded and "base64," in payload:
+            # Handle data URLs like "data:image/png;base64,..."
+            payload = payload.split("base64,")[1]
+
+        cache_key = RasterCache.make_key(payload, max_width=max_width, dither=dither)
+        command = image_cache.get(cache_key)
+        if command is None:
+            # Decode base64 data
+            image_data = base64.b64decode(payload) if encoded else payload
+            command = rasterize_image(image_data, max_width, dither)
+            image_cache.put(cache_key, command)
+            cache = "miss"
+        else:
+            cache = "hit"
         return command
 
     except Exception as e:
-        print(f"Error processing image: {e}")
+        log.warning("Error processing image: %s", e)
         return None
+    finally:
+        image_seconds.observe(time.perf_counter() - start, cache=cache)
+
+
+def rasterize_image(image_data, max_width=IMAGE_MAX_WIDTH, dither=IMAGE_DITHER):
+    """Convert encoded image bytes (PNG, JPG, ...) to a GS v 0 bitmap command"""
+    img = open_image(image_data)
+    img = fit_width(img, max_width)
+    img = to_monochrome(img, dither)
+    return raster_command(img)
+
+
+def open_image(image_data):
+    """Decode image bytes, flattening any transparency onto white"""
+    from PIL import Image
+
+    # Open the image using PIL
+    img = Image.open(BytesIO(image_data))
+    img.load()
+
+    # If image has alpha channel, paste it on white background
+    if img.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])  # Use alpha channel as mask
+        img = background
+    return img
+
+
+def fit_width(img, max_width=IMAGE_MAX_WIDTH):
+    """Resize image if too large - make logo smaller"""
+    from PIL import Image
+
+    if img.width > max_width:
+        ratio = max_width / img.width
+        new_height = int(img.height * ratio)
+        img = img.resize((max_width, new_height), Image.LANCZOS)
+    return img
+
+
+def to_monochrome(img, dither=IMAGE_DITHER):
+    """Convert to black and white (1-bit)"""
+    from PIL import Image
+
+    return img.convert("1", dither=getattr(Image.Dither, DITHER_MODES[dither]))
+
+
+def raster_command(img):
+    """Build the GS v 0 command printing a 1-bit image"""
+    # Get image dimensions
+    width, height = img.size
+
+    # Calculate bytes per line (width / 8, rounded up)
+    bytes_per_line = (width + 7) // 8
+
+    # ESC/POS GS v 0 command for printing bitmap
+    # Format: GS v 0 m xL xH yL yH d1...dk
+    # m=0: normal mode
+    # xL, xH: width in bytes as lower and upper byte
+    # yL, yH: height in pixels as lower and upper byte
+    command = bytearray(
+        GS
+        + b"v0"
+        + bytes(
+            [
+                0,
+                bytes_per_line & 0xFF,
+                (bytes_per_line >> 8) & 0xFF,
+                height & 0xFF,
+                (height >> 8) & 0xFF,
+            ]
+        )
+    )
 
+    # Convert image to bitmap data
+    command.extend(pack_raster(img))
 
-def print_to_windows_printer(printer_name, raw_data):
-    """Send raw data to a Windows printer"""
-    try:
-        # Create a temporary file to hold the ESC/POS commands
-        fd, path = tempfile.mkstemp(suffix=".prn")
-        os.write(fd, raw_data)
-        os.close(fd)
+    return bytes(command)
 
-        # Get the default printer if none specified
-        if not printer_name or printer_name.lower() == "default":
-            printer_name = win32print.GetDefaultPrinter()
 
-        print(f"Printing to: {printer_name}")
+asset_store = AssetStore(ASSET_DIR, rasterize=rasterize_image)
+
+# Codepage selection and bitmap fallback for non-ASCII text
+text_encoder = TextEncoder(
+    TEXT_CODEPAGES,
+    fonts=TEXT_FONTS,
+    raster=raster_command,
+    cache=RasterCache(TEXT_CACHE_BYTES),
+    max_width=PAPER_WIDTH_DOTS,
+)
 
-        # Open the printer
-        hPrinter = win32print.OpenPrinter(printer_name)
-        try:
-            # Start a document
-            hJob = win32print.StartDocPrinter(hPrinter, 1, ("Receipt", None, "RAW"))
-            try:
-                # Start a page
-                win32print.StartPagePrinter(hPrinter)
-
-                # Write the raw data directly to the printer
-                win32print.WritePrinter(hPrinter, raw_data)
-
-                # End the page
-                win32print.EndPagePrinter(hPrinter)
-            finally:
-                # End the document
-                win32print.EndDocPrinter(hPrinter)
-        finally:
-            # Close the printer
-            win32print.ClosePrinter(hPrinter)
-
-        # Remove the temporary file
-        try:
-            os.remove(path)
-        except:
-            pass
 
+def image_ref_commands(name, printer_name=None):
+    """
+    Commands for an image line that references an uploaded asset.
+    Uses the copy in the printer's NV memory when there is one, otherwise
+    the pre-rasterized bitmap from the asset store.
+    """
+    key = asset_store.nv_key(name, printer_name)
+    if key is not None:
+        return nv_print_command(key)
+    raster = asset_store.raster(name)
+    if raster is None:
+        log.warning("Error processing image: unknown asset '%s'", name)
+    return raster
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(printer_name):
+    """Return the transport for a printer, creating it on first use"""
+    with _transports_lock:
+        transport = _transports.get(printer_name)
+        if transport is None:
+            options = dict(PRINTER_TRANSPORTS.get(printer_name) or {})
+            if options.get("type", DEFAULT_TRANSPORT) == "win32":
+                options["default_printer"] = printer_cache.default_printer
+            transport = create_transport(printer_name, options)
+            _transports[printer_name] = transport
+        return transport
+
+
+def send_to_printer(printer_name, raw_data):
+    """Send raw data to a printer through its configured transport"""
+    start = time.perf_counter()
+    try:
+        get_transport(printer_name).send(raw_data)
+        seconds = time.perf_counter() - start
+        transport_seconds.observe(seconds, printer=printer_name, outcome="success")
+        bytes_sent_total.inc(len(raw_data), printer=printer_name)
+        log.info(
+            "Sent %d bytes to %s", len(raw_data), printer_name,
+            extra={
+                "printer": printer_name,
+                "bytes": len(raw_data),
+                "send_ms": round(seconds * 1000, 2),
+            },
+        )
         return True, "Print job sent successfully"
     except Exception as e:
-        print(f"Error printing: {e}")
+        seconds = time.perf_counter() - start
+        transport_seconds.observe(seconds, printer=printer_name, outcome="error")
+        log.error(
+            "Error printing: %s", e,
+            extra={
+                "printer": printer_name,
+                "bytes": len(raw_data),
+                "send_ms": round(seconds * 1000, 2),
+            },
+        )
         return False, str(e)
 
 
-def print_receipt(content, print_type="customer"):
-    """Print receipt to thermal printer"""
+def resolve_printer(print_type="customer", station=None, printer=None):
+    """
+    Pick the printer for a job: an explicit printer wins, then the first
+    routed station tag, then the route of the print_type.
+    :param station: A station tag or a list of them.
+    """
+    if printer:
+        return printer
+    stations = [station] if isinstance(station, str) else station or []
+    for tag in stations:
+        if tag in STATION_ROUTES:
+            return STATION_ROUTES[tag]
+    return PRINTER_ROUTES.get(print_type, PRINTER_NAME)
+
+
+def known_printer(name):
+    """
+    Whether a printer named in a request is one the server prints to: a
+    route, pool or pool member, a PRINTER_TRANSPORTS entry or an installed
+    printer. Each new name would get its own worker, transport and metrics.
+    """
+    if not isinstance(name, str):
+        return False
+    configured = {PRINTER_NAME, *PRINTER_ROUTES.values(), *STATION_ROUTES.values()}
+    configured.update(PRINTER_POOLS, PRINTER_TRANSPORTS)
+    for members in PRINTER_POOLS.values():
+        configured.update(members)
+    return name in configured or name in list_printers()
+
+
+def printer_status(printer_name):
+    """Status flags of a printer as reported by its transport"""
+    return get_transport(printer_name).query_status()
+
+
+def render_job(content, print_type="customer", printer_name=None):
+    """Render a queued job, timing it for /metrics"""
+    start = time.perf_counter()
     try:
-        commands = generate_esc_pos_commands(content, print_type)
-        return print_to_windows_printer(PRINTER_NAME, commands)
-    except Exception as e:
-        print(f"Error printing receipt: {e}")
-        return False, str(e)
+        return generate_esc_pos_commands(content, print_type, printer_name)
+    finally:
+        # Labelled with the kind, not the client's string, to bound the series
+        render_seconds.observe(
+            time.perf_counter() - start, print_type=receipt_kind(print_type)
+        )
+
+
+def record_job(job):
+    """Count and log a finished job and how long it waited, for /metrics and the logs"""
+    jobs_total.inc(
+        print_type=receipt_kind(job.print_type), printer=job.device, outcome=job.status
+    )
+    if "rendering" in job.timestamps:
+        queue_seconds.observe(
+            job.timestamps["rendering"] - job.timestamps["queued"], printer=job.device
+        )
+    details = job.to_dict()
+    log.log(
+        logging.INFO if job.status == "done" else logging.WARNING,
+        "Job %s %s on %s", job.id, job.status, job.device,
+        extra={
+            "job_id": job.id,
+            "print_type": job.print_type,
+            "printer": job.printer,
+            "device": job.device,
+            "status": job.status,
+            "attempts": job.attempts,
+            "bytes": job.bytes,
+            "error": job.error,
+            **details["timings"],
+        },
+    )
+
+
+# Samples jobs with cProfile on demand, see /debug/profile
+profiler = Profiler()
+
+# Print jobs are rendered and spooled by a background worker per printer
+job_manager = JobManager(
+    render=render_job,
+    send=send_to_printer,
+    pools=PRINTER_POOLS,
+    status=printer_status,
+    health_interval=PRINTER_HEALTH_INTERVAL,
+    priorities=PRINT_PRIORITIES,
+    default_priority=DEFAULT_PRIORITY,
+    aging=PRIORITY_AGING_SECONDS,
+    on_finish=record_job,
+    profiler=profiler,
+    max_queued_jobs=PRINTER_QUEUE_MAX_JOBS,
+    max_queued_bytes=PRINTER_QUEUE_MAX_BYTES,
+    coalesce_seconds=KITCHEN_COALESCE_SECONDS,
+    coalesce_key=kitchen_table,
+    mergeable=plain_kitchen_ticket,
+    merge=merge_kitchen_tickets,
+)
+
+
+def read_print_request():
+    """
+    JSON body of a print request. Besides plain JSON this accepts bodies
+    compressed with Content-Encoding gzip or deflate, and multipart uploads
+    with the JSON in a "payload" field and images as binary parts that
+    image lines refer to with {"type": "image", "part": "<part name>"}.
+    """
+    encoding = request.headers.get("Content-Encoding", "identity").strip().lower()
+    if request.mimetype == "multipart/form-data":
+        if encoding != "identity":
+            raise UnsupportedEncoding("Multipart requests can't be compressed")
+        if "payload" in request.form:
+            payload = json.loads(request.form["payload"])
+        elif "payload" in request.files:
+            payload = json.load(request.files["payload"])
+        else:
+            raise ValueError("Multipart request has no 'payload' part")
+        read_parts = {}
+        contents = [payload.get("content")]
+        contents += [job.get("content") for job in payload.get("jobs") or [] if isinstance(job, dict)]
+        for content in contents:
+            if isinstance(content, list):
+                attach_parts(content, request.files, read_parts)
+        return payload
+    if encoding == "identity":
+        return request.json
+    return read_json(request.stream, encoding, MAX_DECOMPRESSED_BYTES)
+
+
+def body_error_response(e):
+    """Response for a body read_print_request couldn't decode"""
+    if isinstance(e, BodyTooLarge):
+        requests_rejected_total.inc(reason="too_large")
+        return jsonify({"error": str(e)}), 413
+    if isinstance(e, UnsupportedEncoding):
+        return jsonify({"error": str(e)}), 415
+    return jsonify({"error": f"Invalid request body: {e}"}), 400
 
 
 @app.route("/print", methods=["POST"])
 def handle_print():
-    if not validate_api_key(request):
+    if not validate_api_key(request, rate_limited=True):
         return jsonify({"error": "Unauthorized"}), 401
     try:
-        content = request.json.get("content")
-        print_type = request.json.get("print_type", "customer")
+        body = read_print_request()
+    except ValueError as e:
+        return body_error_response(e)
+    try:
+        content = body.get("content")
+        print_type = body.get("print_type", "customer")
         if not content:
             return jsonify({"error": "Print content is required"}), 400
-        success, message = print_receipt(content, print_type)
-        if success:
-            return jsonify({"success": True, "message": "Print job sent successfully"})
-        else:
-            return jsonify({"error": message}), 500
+        printer = body.get("printer")
+        if printer and not known_printer(printer):
+            return jsonify({"error": f"Unknown printer '{printer}'"}), 400
+        printer_name = resolve_printer(print_type, body.get("station"), printer)
+        job = job_manager.submit(content, print_type, printer_name, body.get("priority"))
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "message": "Print job queued",
+                    "job_id": job.id,
+                    "printer": job.printer,
+                    "status": job.status,
+                }
+            ),
+            202,
+        )
+    except QueueFull as e:
+        return too_many_requests(str(e), e.retry_after, "queue_full")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/pools", methods=["GET"])
+def get_pools():
+    """Endpoint to see which pool members are in rotation and how busy they are"""
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"pools": job_manager.pool_status()})
+
+
+@app.route("/print/batch", methods=["POST"])
+def handle_print_batch():
+    """
+    Endpoint to queue several tickets at once (e.g. the customer receipt and
+    the kitchen ticket of an order). Tickets for the same printer are sent
+    to it as one document.
+    """
+    if not validate_api_key(request, rate_limited=True):
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        body = read_print_request()
+    except ValueError as e:
+        return body_error_response(e)
+    try:
+        batch = body.get("jobs")
+        if not batch or not isinstance(batch, list):
+            return jsonify({"error": "A list of jobs is required"}), 400
+
+        results = [None] * len(batch)
+        specs = []
+        indexes = []
+        for index, entry in enumerate(batch):
+            content = entry.get("content") if isinstance(entry, dict) else None
+            if not content:
+                results[index] = {
+                    "index": index,
+                    "status": "rejected",
+                    "error": "Print content is required",
+                }
+                continue
+            print_type = entry.get("print_type", "customer")
+            printer = entry.get("printer")
+            if printer and not known_printer(printer):
+                return jsonify({"error": f"Unknown printer '{printer}' in job {index}"}), 400
+            printer_name = resolve_printer(print_type, entry.get("station"), printer)
+            specs.append((content, print_type, printer_name, entry.get("priority")))
+            indexes.append(index)
+
+        for index, job in zip(indexes, job_manager.submit_batch(specs)):
+            results[index] = {
+                "index": index,
+                "job_id": job.id,
+                "printer": job.printer,
+                "status": job.status,
+            }
+        return jsonify({"success": bool(specs), "jobs": results}), 202
+    except BatchTooLarge as e:
+        requests_rejected_total.inc(reason="batch_too_large")
+        return jsonify({"error": str(e)}), 413
+    except QueueFull as e:
+        return too_many_requests(str(e), e.retry_after, "queue_full")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Endpoint to check the progress of a queued print job"""
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Endpoint for Prometheus: latencies of every pipeline stage, job counts and queues"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/debug/profile", methods=["POST"])
+def start_profile():
+    """
+    Endpoint to profile the next jobs with cProfile, without restarting.
+    Body: {"jobs": 20} and/or {"seconds": 60}, optionally {"print_type": "kitchen"}
+    """
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    options = request.get_json(silent=True) or {}
+    try:
+        jobs = int(options["jobs"]) if options.get("jobs") is not None else None
+        seconds = float(options["seconds"]) if options.get("seconds") is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "jobs and seconds must be numbers"}), 400
+    if jobs is None and seconds is None:
+        seconds = 60
+    session = profiler.start(jobs, seconds, options.get("print_type"))
+    if session is None:
+        return jsonify({"error": "A profile is already running"}), 409
+    return jsonify({"success": True, "profile": session.summary()}), 201
+
+
+@app.route("/debug/profile", methods=["GET"])
+def get_profile():
+    """
+    Endpoint to read the running or last profile.
+    ?format=pstats (default, &sort=cumulative&limit=40), collapsed or json
+    """
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    session = profiler.current()
+    if session is None:
+        return jsonify({"error": "No profile has been recorded"}), 404
+    output = request.args.get("format", "pstats")
+    if output == "json":
+        return jsonify(session.summary())
+    if output == "collapsed":
+        return Response(session.collapsed(), mimetype="text/plain")
+    try:
+        text = session.pstats_text(
+            request.args.get("sort", "cumulative"),
+            int(request.args.get("limit", 40)),
+        )
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid sort or limit: {e}"}), 400
+    return Response(text, mimetype="text/plain")
+
+
+@app.route("/debug/profile", methods=["DELETE"])
+def stop_profile():
+    """Endpoint to end the running profile early, keeping its results"""
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    session = profiler.stop()
+    if session is None:
+        return jsonify({"error": "No profile has been recorded"}), 404
+    return jsonify({"success": True, "profile": session.summary()})
+
+
+@app.route("/debug/logs", methods=["GET"])
+def get_logs():
+    """
+    Endpoint to read the most recent log records, newest first.
+    ?limit=100&level=WARNING, and any field to match, e.g. &job_id=... or &printer=...
+    """
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    filters = request.args.to_dict()
+    try:
+        limit = int(filters.pop("limit", 100))
+        records = log_pipeline.ring.records(limit, filters.pop("level", None), **filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"records": records})
+
+
+@app.route("/processes", methods=["GET"])
+def get_processes():
+    """Endpoint to see whether the companion programs are running and ready"""
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"processes": supervisor.status()})
+
+
+@app.route("/image-cache", methods=["GET"])
+def get_image_cache():
+    """Endpoint to see how well the logo raster and bitmap text caches are doing"""
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(dict(image_cache.stats(), text=text_encoder.stats()))
+
+
+@app.route("/assets", methods=["GET"])
+def list_assets():
+    """Endpoint to list uploaded image assets"""
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"assets": asset_store.list()})
+
+
+@app.route("/assets/<name>", methods=["POST", "PUT"])
+def upload_asset(name):
+    """
+    Endpoint to upload an image once so receipts can use
+    {"type": "image", "ref": "<name>"} instead of sending the image every time
+    """
+    if not validate_api_key(request, rate_limited=True):
+        return jsonify({"error": "Unauthorized"}), 401
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "A JSON object with the image data is required"}), 400
+    try:
+        image_data = body.get("data", "")
+        if not image_data or not isinstance(image_data, str):
+            return jsonify({"error": "Image data is required"}), 400
+        if "base64," in image_data:
+            image_data = image_data.split("base64,")[1]
+        meta = asset_store.put(name, base64.b64decode(image_data))
+        return jsonify({"success": True, "asset": meta}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/assets/<name>", methods=["DELETE"])
+def delete_asset(name):
+    """
+    Endpoint to remove an uploaded image asset, also from the NV memory of
+    the printers it was stored in
+    """
+    if not validate_api_key(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    meta = asset_store.delete(name)
+    if meta is None:
+        return jsonify({"error": "Asset not found"}), 404
+    nv_errors = {}
+    for printer_name in meta["nv_printers"]:
+        success, message = send_to_printer(printer_name, nv_delete_command(meta["key"]))
+        if not success:
+            log.warning(
+                "Error removing asset '%s' from NV memory: %s", name, message,
+                extra={"printer": printer_name},
+            )
+            nv_errors[printer_name] = message
+    return jsonify({"success": True, "asset": meta, "nv_errors": nv_errors})
+
+
+@app.route("/assets/<name>/nv", methods=["POST"])
+def store_asset_in_printer(name):
+    """
+    Endpoint to download an asset into the printer's NV graphics memory.
+    Receipts referencing it then send a few bytes instead of the bitmap.
+    NV memory wears out, so only do this when the image changes.
+    """
+    if not validate_api_key(request, rate_limited=True):
+        return jsonify({"error": "Unauthorized"}), 401
+    meta = asset_store.get(name)
+    if meta is None:
+        return jsonify({"error": "Asset not found"}), 404
+    body = request.get_json(silent=True)
+    printer_name = (body if isinstance(body, dict) else {}).get("printer", PRINTER_NAME)
+    if not known_printer(printer_name):
+        return jsonify({"error": f"Unknown printer '{printer_name}'"}), 400
+    # Jobs for a pool are rendered for the member printing them, so every
+    # member needs its own copy
+    printers = PRINTER_POOLS.get(printer_name, [printer_name])
+    command = nv_define_command(meta["key"], asset_store.raster(name))
+    errors = []
+    for member in printers:
+        success, message = send_to_printer(member, command)
+        if success:
+            asset_store.mark_nv(name, member)
+        else:
+            errors.append(f"{member}: {message}" if len(printers) > 1 else message)
+    if errors:
+        return jsonify({"error": "; ".join(errors), "asset": asset_store.get(name)}), 500
+    return jsonify({"success": True, "asset": asset_store.get(name)})
+
+
 @app.route("/", methods=["GET"])
 def home():
     """Server homepage with basic information and test print option"""
@@ -449,6 +1457,9 @@ def home():
             .dropzone { border: 2px dashed #ccc; border-radius: 5px; padding: 25px; text-align: center; margin: 20px 0; }
             .dropzone.highlight { border-color: #2196F3; background: #e3f2fd; }
             #imagePreview { max-width: 100%; max-height: 200px; margin-top: 10px; display: none; }
+            table { border-collapse: collapse; width: 100%; font-size: 14px; }
+            th, td { text-align: left; padding: 4px 8px; border-bottom: 1px solid #ddd; }
+            td.num { text-align: right; font-family: monospace; }
         </style>
     </head>
     <body>
@@ -472,6 +1483,13 @@ def home():
             <button id="printWithLogo" disabled>Print Receipt with Logo</button>
             
             <div id="result"></div>
+
+            <h2>Metrics</h2>
+            <p>Refreshed every 5 seconds from <code>GET /metrics</code>.</p>
+            <table>
+                <thead><tr><th>Metric</th><th>Labels</th><th>Count / value</th><th>Mean ms</th></tr></thead>
+                <tbody id="metricsTable"><tr><td colspan="4">Loading metrics...</td></tr></tbody>
+            </table>
             
             <h2>API Documentation</h2>
             <p>Send print requests to: <code>POST /print</code></p>
@@ -493,9 +1511,62 @@ def home():
                 .then(response => response.json())
                 .then(data => {
                     document.getElementById('printerList').textContent = 
-                        data.printers.join('\\n');
+                        data.printers.join('\\n') +
+                        '\\n\\n(list from ' + Math.round(data.age) + 's ago)';
                 });
                 
+            // Summarize the Prometheus metrics: count and mean of every
+            // histogram series, value of every counter and gauge series
+            function loadMetrics() {
+                fetch('/metrics')
+                    .then(response => response.text())
+                    .then(text => {
+                        const rows = new Map();
+                        text.split('\\n').forEach(line => {
+                            if (!line || line.startsWith('#')) return;
+                            const space = line.lastIndexOf(' ');
+                            const series = line.slice(0, space);
+                            const value = parseFloat(line.slice(space + 1));
+                            const brace = series.indexOf('{');
+                            let name = brace < 0 ? series : series.slice(0, brace);
+                            const labels = brace < 0 ? '' : series.slice(brace + 1, -1);
+                            if (name.endsWith('_bucket')) return;
+                            let field = 'value';
+                            if (name.endsWith('_sum') || name.endsWith('_count')) {
+                                field = name.endsWith('_sum') ? 'sum' : 'count';
+                                name = name.slice(0, name.lastIndexOf('_'));
+                            }
+                            const key = name + '|' + labels;
+                            if (!rows.has(key)) rows.set(key, {name: name, labels: labels});
+                            rows.get(key)[field] = value;
+                        });
+                        const body = document.getElementById('metricsTable');
+                        body.innerHTML = '';
+                        rows.forEach(row => {
+                            const tr = document.createElement('tr');
+                            const isHistogram = row.count !== undefined;
+                            const cells = [
+                                row.name.replace('print_server_', ''),
+                                row.labels.replaceAll('"', ''),
+                                isHistogram ? row.count : row.value,
+                                isHistogram && row.count ? (row.sum / row.count * 1000).toFixed(2) : ''
+                            ];
+                            cells.forEach((cell, i) => {
+                                const td = document.createElement('td');
+                                td.textContent = cell;
+                                if (i >= 2) td.className = 'num';
+                                tr.appendChild(td);
+                            });
+                            body.appendChild(tr);
+                        });
+                        if (!rows.size) {
+                            body.innerHTML = '<tr><td colspan="4">No samples yet</td></tr>';
+                        }
+                    });
+            }
+            loadMetrics();
+            setInterval(loadMetrics, 5000);
+
             // Display current printer name
             document.getElementById('currentPrinter').textContent = 
                 'POSPrinter POS80';
@@ -659,15 +1730,28 @@ def home():
 
 @app.route("/printers", methods=["GET"])
 def get_printers():
-    """Endpoint to get available printers"""
-    printers = list_printers()
-    return jsonify({"printers": printers})
+    """
+    Endpoint to get available printers, from a cache refreshed in the
+    background. "age" is how many seconds old the list is; ?refresh=1
+    enumerates them now. Clients can send back the ETag to only get the
+    list when it changed.
+    """
+    if request.args.get("refresh"):
+        snapshot = printer_cache.refresh()
+    else:
+        snapshot = printer_cache.get()
+    etag = f'"printers-{snapshot["version"]}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return "", 304, {"ETag": etag}
+    response = jsonify(snapshot)
+    response.headers["ETag"] = etag
+    return response
 
 
 @app.route("/test-print", methods=["POST"])
 def test_print():
     """Endpoint to send a test print from the web interface"""
-    if not validate_api_key(request):
+    if not validate_api_key(request, rate_limited=True):
         return jsonify({"error": "Unauthorized"}), 401
 
     test_content = [
@@ -677,96 +1761,186 @@ def test_print():
         {"type": "text", "text": "Printer server is working!"},
     ]
 
-    success, message = print_receipt(test_content)
+    # Queued behind real orders, but the page still waits for the outcome
+    try:
+        job = job_manager.submit(
+            test_content, "customer", resolve_printer("customer"), priority="test"
+        )
+    except QueueFull as e:
+        return too_many_requests(str(e), e.retry_after, "queue_full")
+    if not job.wait(TEST_PRINT_TIMEOUT):
+        return jsonify({"success": False, "error": "Test print is still queued"}), 504
 
-    if success:
+    if job.status == "done":
         return jsonify({"success": True, "message": "Test print sent successfully!"})
     else:
-        return jsonify({"success": False, "error": message}), 500
-
-
-def send_test_print():
-    """Send a test print to confirm printer is working"""
-    print("\nSending test print to verify printer setup...")
-    test_content = [
-        {"type": "header", "text": "TEST RECEIPT"},
-        {"type": "item", "name": "Test Item", "quantity": 1, "price": 9.99},
-        {"type": "total", "amount": 9.99},
-        {"type": "text", "text": "Printer server is working!"},
-    ]
-
-    success, message = print_receipt(test_content)
-    if success:
-        print("✓ Test print successful! Printer is ready.")
-    else:
-        print(f"✗ Test print failed: {message}")
-        print("Check printer connection and configuration.")
+        return jsonify({"success": False, "error": job.error}), 500
 
 
-def start_nextjs_project(nextjs_path, port=3000):
+def serve(dev=False):
     """
-    Start a built Next.js project using 'next start' and open it in the browser.
-    :param nextjs_path: Path to the Next.js project directory (where package.json is).
-    :param port: Port to run the Next.js server on (default 3000).
+    Serve the app with waitress, a multi-threaded production WSGI server
+    that keeps connections alive (e.g. the ones from cloudflared).
+    Falls back to the threaded Flask development server when dev is set or
+    waitress isn't installed.
     """
-    try:
-        if sys.platform == "win32":
-            command = f'cmd /c "cd /d {nextjs_path} && npx next start -p {port}"'
-            subprocess.Popen(
-                command, shell=True, creationflags=subprocess.CREATE_NEW_CONSOLE
-            )
+    if not dev:
+        try:
+            from waitress import serve as waitress_serve
+        except ImportError:
+            log.warning("waitress is not installed, using the Flask development server")
         else:
-            command = f"cd {nextjs_path} && npx next start -p {port}"
-            subprocess.Popen(command, shell=True)
-        print(f"Next.js project started at http://localhost:{port}")
+            log.info("Serving with waitress, %d threads", SERVER_THREADS)
+            waitress_serve(
+                app,
+                host=SERVER_HOST,
+                port=SERVER_PORT,
+                threads=SERVER_THREADS,
+                connection_limit=SERVER_CONNECTION_LIMIT,
+                channel_timeout=SERVER_CHANNEL_TIMEOUT,
+                # Oversized bodies are refused before waitress buffers them
+                max_request_body_size=MAX_REQUEST_BYTES,
+                ident="print-server",
+            )
+            return
+    app.run(host=SERVER_HOST, port=SERVER_PORT, threaded=True)
 
-        # Wait a few seconds for the server to start, then open in browser
-        time.sleep(20)
-        webbrowser.open(f"http://localhost:{port}")
 
-    except Exception as e:
-        print(f"Failed to start Next.js project: {e}")
+def open_browser_once(url):
+    """on_ready callback opening url the first time only, not after restarts"""
+    opened = []
 
+    def on_ready(child):
+        if not opened:
+            import webbrowser
 
-def start_node_script(node_script_path):
-    """
-    Start a Node.js script (e.g., index.js) in the given directory.
-    """
-    try:
-        if sys.platform == "win32":
-            command = f'cmd /c "cd /d {node_script_path} && node index.js"'
-            subprocess.Popen(
-                command, shell=True, creationflags=subprocess.CREATE_NEW_CONSOLE
+            opened.append(url)
+            webbrowser.open(url)
+
+    return on_ready
+
+
+def companion_processes():
+    """The Next.js app, the node scripts and the Cloudflare tunnel to supervise"""
+    children = []
+    if NEXTJS_PATH:
+        children.append(
+            ChildProcess(
+                "Next.js",
+                f"npx next start -p {NEXTJS_PORT}",
+                cwd=NEXTJS_PATH,
+                shell=True,
+                ready_port=NEXTJS_PORT,
+                on_ready=open_browser_once(f"http://localhost:{NEXTJS_PORT}"),
+                new_console=True,
             )
-        else:
-            command = f"cd {node_script_path} && node index.js"
-            subprocess.Popen(command, shell=True)
-        print(f"Node.js script started in {node_script_path}")
-    except Exception as e:
-        print(f"Failed to start Node.js script: {e}")
+        )
+    for script_path in NODE_SCRIPTS:
+        children.append(
+            ChildProcess(
+                os.path.basename(script_path.rstrip("\\/")),
+                "node index.js",
+                cwd=script_path,
+                shell=True,
+                new_console=True,
+            )
+        )
+    if CLOUDFLARE_TUNNEL and os.path.exists(CLOUDFLARED_PATH):
+        children.append(
+            ChildProcess(
+                "cloudflared",
+                [
+                    CLOUDFLARED_PATH,
+                    "tunnel",
+                    "--metrics",
+                    f"127.0.0.1:{CLOUDFLARED_METRICS_PORT}",
+                    "run",
+                    CLOUDFLARE_TUNNEL,
+                ],
+                ready_url=f"http://127.0.0.1:{CLOUDFLARED_METRICS_PORT}/ready",
+            )
+        )
+    elif CLOUDFLARE_TUNNEL:
+        log.warning("cloudflared not found at %s, tunnel not started", CLOUDFLARED_PATH)
+    return children
 
 
-if __name__ == "__main__":
-    print("Starting Windows printer server...")
-    # start_cloudflare_tunnel()
+# Started from __main__, so importing the server doesn't launch anything
+supervisor = Supervisor([])
+
+
+def exit_on_signal(signum, frame):
+    """Turn SIGTERM, or closing the console on Windows, into a normal exit so atexit handlers run"""
+    sys.exit(0)
 
+
+def check_printers():
+    """Warn about routed printers that aren't installed or configured"""
     # List available printers
     available_printers = list_printers()
 
-    # Check if our target printer is available
-    if PRINTER_NAME not in available_printers:
-        print(f"WARNING: Printer '{PRINTER_NAME}' not found in available printers")
-        print("Please check the printer name and update the PRINTER_NAME variable")
-        print("Available printer names are shown above")
-    else:
-        # Send test print if printer is available
-        time.sleep(5)
+    # Check if our target printers are available
+    routed_printers = {PRINTER_NAME}
+    routed_printers.update(PRINTER_ROUTES.values(), STATION_ROUTES.values())
+    for pool_name, members in PRINTER_POOLS.items():
+        routed_printers.discard(pool_name)
+        routed_printers.update(members)
+    missing_printers = sorted(routed_printers - set(available_printers))
+    for printer_name in missing_printers:
+        log.warning(
+            "Printer '%s' not found in available printers", printer_name,
+            extra={"printer": printer_name},
+        )
+    if missing_printers:
+        log.warning(
+            "Please check the printer names and update PRINTER_NAME/PRINTER_ROUTES."
+            " Available printer names are shown above"
+        )
+    startup_times["printers_checked"] = time.perf_counter() - STARTED_AT
 
-    # Install requirements if you don't have them:
-    # pip install pillow flask flask-cors pywin32
-    start_nextjs_project(r"E:\chikenhut\chikenhutapp", port=3000)
-    start_node_script(r"E:\chikenhut\sendReport")
-    start_node_script(r"E:\chikenhut\dbbackup")
 
-    print(f"Server running on http://localhost:5000")
-    app.run(host="0.0.0.0", port=5000)
+if __name__ == "__main__":
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description="Thermal printer server")
+    parser.add_argument("--dev", action="store_true", help="use the Flask development server")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--no-companions",
+        action="store_true",
+        help="don't start the Next.js app, node scripts and tunnel",
+    )
+    args = parser.parse_args()
+    SERVER_PORT = args.port
+
+    log.info("Starting Windows printer server...")
+
+    # Companion programs start in the background while the API comes up
+    if not args.no_companions:
+        supervisor.children.extend(companion_processes())
+        supervisor.start()
+        # Don't leave the companions running for the next start to trip over
+        atexit.register(supervisor.stop)
+        for name in ("SIGTERM", "SIGBREAK"):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), exit_on_signal)
+
+    if LOG_PATH:
+        log_pipeline.add_file(LOG_PATH, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS)
+
+    # Jobs accepted before a crash or power cut are printed first
+    if JOURNAL_PATH:
+        job_manager.journal = JobJournal(JOURNAL_PATH, keep_seconds=JOURNAL_KEEP_SECONDS)
+        replayed = job_manager.replay()
+        if replayed:
+            log.info("Replaying %d unfinished print jobs from the journal", len(replayed))
+
+    # Enumerating printers can take seconds on Windows, don't wait for it
+    threading.Thread(target=check_printers, name="printer-check", daemon=True).start()
+
+    # Install requirements if you don't have them:
+    # pip install pillow flask flask-cors pywin32 waitress
+    log.info("Server running on http://localhost:%d", SERVER_PORT, extra={"port": SERVER_PORT})
+    startup_times["serving"] = time.perf_counter() - STARTED_AT
+    serve(dev=args.dev)
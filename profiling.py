@@ -0,0 +1,197 @@
+import io
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+# Deeper call chains are cut off in the collapsed stacks
+MAX_STACK_DEPTH = 64
+
+
+class ProfileSession:
+    """Aggregated cProfile data of the jobs sampled by one profiling run"""
+
+    def __init__(self, jobs=None, seconds=None, print_type=None):
+        """
+        :param jobs: Stop after this many jobs were profiled.
+        :param seconds: Stop after this many seconds.
+        :param print_type: Only profile jobs of this print_type.
+        """
+        self.max_jobs = jobs
+        self.seconds = seconds
+        self.print_type = print_type
+        self.jobs = 0
+        self.stats = None
+        self.started_at = time.time()
+        self.ended_at = None
+        self.lock = threading.Lock()
+
+    def expired(self):
+        if self.ended_at is not None:
+            return True
+        if self.max_jobs is not None and self.jobs >= self.max_jobs:
+            return True
+        return self.seconds is not None and time.time() - self.started_at >= self.seconds
+
+    def wants(self, print_types):
+        if self.expired():
+            return False
+        return self.print_type is None or self.print_type in print_types
+
+    def add(self, profile, count):
+        import pstats
+
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.jobs += count
+
+    def summary(self):
+        return {
+            "running": self.ended_at is None,
+            "jobs": self.jobs,
+            "max_jobs": self.max_jobs,
+            "seconds": self.seconds,
+            "print_type": self.print_type,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+        }
+
+    def pstats_text(self, sort="cumulative", limit=40):
+        """The usual pstats table, most expensive functions first"""
+        with self.lock:
+            if self.stats is None:
+                return "No jobs profiled yet\n"
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def collapsed(self):
+        """
+        Collapsed stacks ("root;caller;callee microseconds" per line) for
+        flamegraph.pl or speedscope. cProfile only records caller/callee
+        pairs, so a function called from several places has its time split
+        between them in proportion to the time each caller spent in it.
+        """
+        with self.lock:
+            if self.stats is None:
+                return ""
+            entries = dict(self.stats.stats)
+
+        children = defaultdict(dict)
+        for func, (_, _, _, _, callers) in entries.items():
+            for caller, edge in callers.items():
+                children[caller][func] = edge[3]
+
+        weights = defaultdict(float)
+
+        def walk(func, path, on_path, share):
+            _, _, self_time, total_time, _ = entries[func]
+            if self_time * share > 0:
+                weights[path] += self_time * share
+            if len(on_path) >= MAX_STACK_DEPTH:
+                return
+            for child, edge_time in children[func].items():
+                child_total = entries[child][3]
+                if child in on_path or not child_total or not edge_time:
+                    continue
+                # Share of the child's time that was spent below this path
+                child_share = min(1.0, edge_time * share / child_total)
+                on_path.add(child)
+                walk(child, f"{path};{_frame_name(child)}", on_path, child_share)
+                on_path.discard(child)
+
+        for func, entry in entries.items():
+            if not entry[4]:
+                walk(func, _frame_name(func), {func}, 1.0)
+
+        lines = [
+            f"{path} {round(seconds * 1e6)}"
+            for path, seconds in sorted(weights.items())
+            if round(seconds * 1e6) > 0
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _frame_name(func):
+    filename, lineno, name = func
+    if filename == "~":
+        return name  # built-in, e.g. "<built-in method zlib.compress>"
+    return f"{os.path.basename(filename)}:{name}:{lineno}"
+
+
+class Profiler:
+    """
+    Runs at most one profiling session at a time. Callers check that
+    session is not None before calling profile(), so there is no cost
+    beyond that check while no session is running.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.last = None
+        self.lock = threading.Lock()
+        # Held by the thread whose job is being profiled. Only one profiler
+        # can be active per process (Python 3.12+ refuses a second one), so
+        # jobs of other printers meanwhile run unprofiled.
+        self.profiling = threading.Lock()
+
+    def start(self, jobs=None, seconds=None, print_type=None):
+        """Start a session, or return None if one is already running"""
+        with self.lock:
+            if self.session is not None and not self.session.expired():
+                return None
+            if self.session is not None:
+                self._finish()
+            self.session = ProfileSession(jobs, seconds, print_type)
+            return self.session
+
+    def stop(self):
+        """End the running session early and return it"""
+        with self.lock:
+            if self.session is not None:
+                self._finish()
+            return self.last
+
+    def current(self):
+        """The running session, or the last finished one"""
+        with self.lock:
+            if self.session is not None and self.session.expired():
+                self._finish()
+            return self.session or self.last
+
+    def _finish(self):
+        session, self.session = self.session, None
+        if session.ended_at is None:
+            session.ended_at = time.time()
+        self.last = session
+
+    def profile(self, print_types, func, *args):
+        """Call func, under cProfile if the running session wants these print types"""
+        session = self.session
+        if session is None or not session.wants(print_types):
+            if session is not None and session.expired():
+                self.current()
+            return func(*args)
+        if not self.profiling.acquire(blocking=False):
+            return func(*args)
+        try:
+            import cProfile
+
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool (e.g. a debugger) is active
+                return func(*args)
+            try:
+                return func(*args)
+            finally:
+                profile.disable()
+                session.add(profile, len(print_types))
+        finally:
+            self.profiling.release()
@@ -0,0 +1,39 @@
+import threading
+import time
+
+
+class RateLimited(Exception):
+    """Raised when a client is over its request rate"""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket per key (e.g. per API key): requests may come in bursts of
+    up to burst, and are refilled at rate per second.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # key -> (tokens, monotonic time of last update)
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """
+        Take a token for key.
+        :return: 0 if the request may go ahead, otherwise the seconds until
+            a token is available.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
@@ -0,0 +1,81 @@
+import json
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BodyTooLarge(ValueError):
+    """The decompressed request body is over the allowed size"""
+
+
+class UnsupportedEncoding(ValueError):
+    """The request uses a Content-Encoding the server can't decode"""
+
+
+def _is_zlib_header(data):
+    # CMF says deflate and the two header bytes are a multiple of 31
+    return len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] * 256 + data[1]) % 31 == 0
+
+
+def decompress_stream(stream, encoding, max_bytes):
+    """
+    Inflate a gzip or deflate body while reading it in chunks, giving up as
+    soon as the output would exceed max_bytes (so a small "zip bomb" can't
+    exhaust memory).
+    :param stream: File-like object with the compressed body.
+    :param encoding: "gzip" or "deflate" (zlib wrapped or raw).
+    :return: The decompressed bytes.
+    """
+    if encoding in ("gzip", "x-gzip"):
+        wbits = 16 + zlib.MAX_WBITS
+    elif encoding == "deflate":
+        wbits = None  # zlib or raw deflate, decided by the first bytes
+    else:
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding '{encoding}'")
+
+    inflater = None
+    output = bytearray()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if inflater is None:
+            if wbits is None:
+                wbits = zlib.MAX_WBITS if _is_zlib_header(chunk) else -zlib.MAX_WBITS
+            inflater = zlib.decompressobj(wbits)
+        try:
+            output += inflater.decompress(chunk, max_bytes + 1 - len(output))
+        except zlib.error as e:
+            raise ValueError(f"Invalid {encoding} body: {e}")
+        if len(output) > max_bytes:
+            raise BodyTooLarge(f"Request body is larger than {max_bytes} bytes uncompressed")
+    if inflater is None or not inflater.eof:
+        raise ValueError(f"Truncated {encoding} body")
+    return output
+
+
+def read_json(stream, encoding, max_bytes):
+    """Parse a compressed JSON body"""
+    return json.loads(decompress_stream(stream, encoding, max_bytes))
+
+
+def attach_parts(content, files, read_parts=None):
+    """
+    Resolve image lines of a multipart request that refer to a binary part,
+    e.g. {"type": "image", "part": "logo"}, by adding the part's bytes to the
+    line as "blob". Each part is read once, however many lines use it.
+    :param content: List of content lines, modified in place.
+    :param files: Mapping of part name -> uploaded file.
+    :param read_parts: Dict of already read parts, shared between calls.
+    """
+    read_parts = {} if read_parts is None else read_parts
+    for line in content:
+        if not isinstance(line, dict) or "part" not in line:
+            continue
+        name = line["part"]
+        if name not in read_parts:
+            if name not in files:
+                raise ValueError(f"Multipart request has no part named '{name}'")
+            read_parts[name] = files[name].read()
+        line["blob"] = read_parts[name]
+    return content
@@ -0,0 +1,268 @@
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+
+class ChildProcess:
+    """A companion program started and kept running by the Supervisor"""
+
+    def __init__(
+        self,
+        name,
+        command,
+        cwd=None,
+        shell=False,
+        ready_port=None,
+        ready_url=None,
+        on_ready=None,
+        new_console=False,
+    ):
+        """
+        :param command: Argument list, or a command line when shell is set.
+        :param ready_port: The child is ready once this local port accepts connections.
+        :param ready_url: The child is ready once this URL answers without a 5xx error.
+        :param on_ready: Callable (child) called every time the child becomes ready.
+        :param new_console: Give the child its own console window (Windows).
+        """
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.shell = shell
+        self.ready_port = ready_port
+        self.ready_url = ready_url
+        self.on_ready = on_ready
+        self.new_console = new_console
+        self.process = None
+        self.ready = False
+        # An instance we didn't start already serves ready_port
+        self.external = False
+        self.restarts = 0
+        self.started_at = None
+        self.last_exit_code = None
+        self.last_error = None
+
+    def launch(self):
+        flags = 0
+        if sys.platform == "win32":
+            flags = (
+                subprocess.CREATE_NEW_CONSOLE
+                if self.new_console
+                else subprocess.CREATE_NO_WINDOW
+            )
+        self.process = subprocess.Popen(
+            self.command,
+            cwd=self.cwd,
+            shell=self.shell,
+            stdout=None if self.new_console else subprocess.DEVNULL,
+            stderr=None if self.new_console else subprocess.DEVNULL,
+            creationflags=flags,
+            # Own process group, so stop() also reaches what a shell started
+            start_new_session=sys.platform != "win32",
+        )
+        self.started_at = time.time()
+        self.ready = False
+
+    def stop(self, timeout=5):
+        """
+        Stop the child and every process it started, e.g. node under npx
+        under cmd.exe, which terminate() alone would leave running.
+        """
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        if sys.platform == "win32":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                creationflags=subprocess.CREATE_NO_WINDOW,
+            )
+        else:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait(timeout)
+            except ProcessLookupError:
+                return
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            log.warning("%s (pid %s) did not stop", self.name, process.pid)
+
+    def port_open(self):
+        """Whether something accepts connections on ready_port"""
+        try:
+            with socket.create_connection(("127.0.0.1", self.ready_port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+
+    def is_ready(self):
+        """Probe the readiness port or URL once"""
+        if self.ready_port is not None and not self.port_open():
+            return False
+        if self.ready_url is not None:
+            try:
+                with urllib.request.urlopen(self.ready_url, timeout=1) as resp:
+                    return resp.status < 500
+            except urllib.error.HTTPError as e:
+                return e.code < 500
+            except OSError:
+                return False
+        return True
+
+    def status(self):
+        running = self.process is not None and self.process.poll() is None
+        return {
+            "name": self.name,
+            "running": running or self.external,
+            "ready": (running or self.external) and self.ready,
+            "external": self.external,
+            "pid": self.process.pid if running else None,
+            "restarts": self.restarts,
+            "uptime": round(time.time() - self.started_at, 1) if running else None,
+            "last_exit_code": self.last_exit_code,
+            "last_error": self.last_error,
+        }
+
+
+class Supervisor:
+    """
+    Starts companion processes in parallel, each watched by its own thread.
+    Readiness is detected by polling instead of sleeping, and children that
+    exit are restarted with exponential backoff, until they fail
+    max_failures times in a row. A child whose ready_port is already served
+    (e.g. by the instance a previous run left behind) isn't started twice.
+    """
+
+    # Seconds between checks that an instance we didn't start is still there
+    EXTERNAL_CHECK_SECONDS = 5
+
+    def __init__(
+        self,
+        children,
+        backoff=1,
+        max_backoff=60,
+        stable_after=60,
+        poll_interval=0.25,
+        max_failures=5,
+    ):
+        """
+        :param backoff: Seconds before the first restart, doubled on every crash.
+        :param max_backoff: Longest wait between restarts.
+        :param stable_after: A child that ran this many seconds restarts with
+            the initial backoff again.
+        :param poll_interval: Seconds between readiness probes and exit checks.
+        :param max_failures: Failed starts or crashes before stable_after in a
+            row after which a child is given up on, None to retry forever.
+        """
+        self.children = list(children)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.poll_interval = poll_interval
+        self.max_failures = max_failures
+        self.stopping = threading.Event()
+
+    def start(self):
+        """Launch every child and return immediately"""
+        for child in self.children:
+            threading.Thread(
+                target=self._watch, args=(child,), name=f"supervise-{child.name}", daemon=True
+            ).start()
+        return self
+
+    def _watch(self, child):
+        delay = self.backoff
+        failures = 0
+        while not self.stopping.is_set():
+            if child.ready_port is not None and child.port_open():
+                self._wait_for_external(child)
+                continue
+            try:
+                child.launch()
+                log.info("Started %s (pid %s)", child.name, child.process.pid)
+            except Exception as e:
+                child.last_error = str(e)
+                log.error("Failed to start %s: %s", child.name, e)
+            else:
+                if self.stopping.is_set():
+                    child.stop()
+                    return
+                self._wait_for_exit(child)
+                if self.stopping.is_set():
+                    return
+                child.last_exit_code = child.process.returncode
+                log.warning("%s exited with code %s", child.name, child.last_exit_code)
+                if time.time() - child.started_at >= self.stable_after:
+                    delay = self.backoff
+                    failures = 0
+
+            failures += 1
+            if self.max_failures is not None and failures >= self.max_failures:
+                child.last_error = f"Not restarted after {failures} failures in a row"
+                log.error(
+                    "%s failed %d times in a row, not restarting it", child.name, failures
+                )
+                return
+            log.info("Restarting %s in %gs", child.name, delay)
+            if self.stopping.wait(delay):
+                return
+            child.restarts += 1
+            delay = min(delay * 2, self.max_backoff)
+
+    def _became_ready(self, child):
+        child.ready = True
+        if child.on_ready is not None:
+            try:
+                child.on_ready(child)
+            except Exception as e:
+                log.error("Error in ready callback of %s: %s", child.name, e)
+
+    def _wait_for_exit(self, child):
+        # Probe readiness until it succeeds, then just watch for an exit
+        while child.process.poll() is None:
+            if not child.ready and child.is_ready():
+                if child.ready_port is not None or child.ready_url is not None:
+                    took = time.time() - child.started_at
+                    log.info("%s is ready after %.1fs", child.name, took)
+                self._became_ready(child)
+            if self.stopping.wait(self.poll_interval):
+                return
+
+    def _wait_for_external(self, child):
+        # Use the instance already on the port until it goes away
+        log.info(
+            "%s is already running on port %s, not starting another",
+            child.name, child.ready_port,
+        )
+        child.external = True
+        self._became_ready(child)
+        while not self.stopping.wait(self.EXTERNAL_CHECK_SECONDS):
+            if not child.port_open():
+                log.warning("%s on port %s went away", child.name, child.ready_port)
+                break
+        child.external = False
+        child.ready = False
+
+    def status(self):
+        return [child.status() for child in self.children]
+
+    def stop(self):
+        """Stop supervising and stop every child with the processes it started"""
+        self.stopping.set()
+        for child in self.children:
+            try:
+                child.stop()
+            except Exception as e:
+                log.error("Error stopping %s: %s", child.name, e)
@@ -0,0 +1,118 @@
+GS = bytes([0x1D])
+
+# GS ( k <Function 169> error correction levels, ~7%, 15%, 25% and 30%
+QR_ERROR_CORRECTION = {"L": 48, "M": 49, "Q": 50, "H": 51}
+# Bytes the printer can hold for one QR symbol (version 40, level L)
+QR_MAX_DATA = 7089
+
+# GS k <Function B> symbology codes and the characters each accepts
+BARCODE_SYMBOLOGIES = {
+    "UPC-A": (65, "0123456789"),
+    "UPC-E": (66, "0123456789"),
+    "EAN13": (67, "0123456789"),
+    "EAN8": (68, "0123456789"),
+    "CODE39": (69, "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ -.$/+%*"),
+    "ITF": (70, "0123456789"),
+    "CODABAR": (71, "0123456789ABCDabcd$+-./:"),
+    "CODE93": (72, None),  # any ASCII
+    "CODE128": (73, None),  # any ASCII
+}
+# Digits without / with the check digit, the printer adds a missing one
+BARCODE_LENGTHS = {
+    "UPC-A": (11, 12),
+    "UPC-E": (6, 7, 8, 11, 12),
+    "EAN13": (12, 13),
+    "EAN8": (7, 8),
+}
+# GS H: where the human readable digits go
+HRI_POSITIONS = {"none": 0, "above": 1, "below": 2, "both": 3}
+HRI_FONTS = {"A": 0, "B": 1}
+
+
+def _qr_function(fn, params):
+    # GS ( k pL pH cn=49 fn params
+    body = bytes([49, fn]) + params
+    return GS + b"(k" + len(body).to_bytes(2, "little") + body
+
+
+def qr_command(data, size=6, error_correction="M"):
+    """
+    Build GS ( k commands that store and print a model 2 QR code.
+    :param data: Text (UTF-8 encoded) or bytes to encode.
+    :param size: Module size in dots, 1 to 16.
+    :param error_correction: "L", "M", "Q" or "H".
+    """
+    payload = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+    if not payload:
+        raise ValueError("QR code data is required")
+    if len(payload) > QR_MAX_DATA:
+        raise ValueError(f"QR code data is longer than {QR_MAX_DATA} bytes")
+    size = int(size)
+    if not 1 <= size <= 16:
+        raise ValueError("QR code size must be between 1 and 16")
+    level = QR_ERROR_CORRECTION.get(str(error_correction).upper())
+    if level is None:
+        raise ValueError(f"Unknown QR error correction level '{error_correction}'")
+    return (
+        _qr_function(65, b"\x32\x00")  # fn 165: model 2
+        + _qr_function(67, bytes([size]))  # fn 167: module size
+        + _qr_function(69, bytes([level]))  # fn 169: error correction
+        + _qr_function(80, b"\x30" + payload)  # fn 180: store the data
+        + _qr_function(81, b"\x30")  # fn 181: print it
+    )
+
+
+def barcode_command(
+    data, symbology="CODE128", height=80, width=2, hri="below", hri_font="A"
+):
+    """
+    Build the GS H / GS f / GS h / GS w settings and the GS k command
+    printing a 1D barcode.
+    :param symbology: One of BARCODE_SYMBOLOGIES.
+    :param height: Bar height in dots, 1 to 255.
+    :param width: Module width in dots, 2 to 6.
+    :param hri: Human readable text position: "none", "above", "below" or "both".
+    :param hri_font: "A" or "B".
+    """
+    symbology = str(symbology).upper()
+    if symbology not in BARCODE_SYMBOLOGIES:
+        raise ValueError(f"Unknown barcode symbology '{symbology}'")
+    code, charset = BARCODE_SYMBOLOGIES[symbology]
+    text = str(data)
+    if not text:
+        raise ValueError("Barcode data is required")
+    if charset is not None and any(c not in charset for c in text):
+        raise ValueError(f"Invalid character in {symbology} barcode data '{text}'")
+    if symbology in BARCODE_LENGTHS and len(text) not in BARCODE_LENGTHS[symbology]:
+        raise ValueError(f"{symbology} barcode data must have {BARCODE_LENGTHS[symbology]} digits")
+    if symbology == "ITF" and len(text) % 2:
+        raise ValueError("ITF barcode data must have an even number of digits")
+    if symbology == "CODE128" and text[:2] not in ("{A", "{B", "{C"):
+        # Code set B covers all printable ASCII; a literal "{" is written "{{"
+        text = "{B" + text.replace("{", "{{")
+    try:
+        payload = text.encode("ascii")
+    except UnicodeEncodeError:
+        raise ValueError(f"Barcode data must be ASCII: '{text}'")
+    if len(payload) > 255:
+        raise ValueError("Barcode data is longer than 255 bytes")
+
+    height = int(height)
+    width = int(width)
+    if not 1 <= height <= 255:
+        raise ValueError("Barcode height must be between 1 and 255")
+    if not 2 <= width <= 6:
+        raise ValueError("Barcode width must be between 2 and 6")
+    position = HRI_POSITIONS.get(str(hri).lower())
+    if position is None:
+        raise ValueError(f"Unknown barcode HRI position '{hri}'")
+    font = HRI_FONTS.get(str(hri_font).upper())
+    if font is None:
+        raise ValueError(f"Unknown barcode HRI font '{hri_font}'")
+    return (
+        GS + b"H" + bytes([position])
+        + GS + b"f" + bytes([font])
+        + GS + b"h" + bytes([height])
+        + GS + b"w" + bytes([width])
+        + GS + b"k" + bytes([code, len(payload)]) + payload
+    )
@@ -0,0 +1,198 @@
+import functools
+import re
+import threading
+
+from image_cache import RasterCache
+
+ESC = bytes([0x1B])
+
+# Codepages selectable with ESC t n on Epson compatible printers, and their
+# number. The Python codec of each has the same name.
+CODEPAGES = {
+    "cp437": 0,  # USA, Standard Europe (the usual power-on default)
+    "cp850": 2,  # Multilingual
+    "cp860": 3,  # Portuguese
+    "cp863": 4,  # Canadian-French
+    "cp865": 5,  # Nordic
+    "cp1252": 16,  # Windows Latin 1
+    "cp866": 17,  # Cyrillic
+    "cp852": 18,  # Latin 2
+    "cp858": 19,  # cp850 with the euro sign
+}
+
+# Character cell of the printer fonts in dots, used to place bitmap text
+# where the printer would have put the characters
+FONT_A_CELL = (12, 24)
+FONT_B_CELL = (9, 17)
+
+_WORDS = re.compile(r"\S+")
+
+
+class Codepage:
+    """A printer codepage and its translation table, built once"""
+
+    def __init__(self, name):
+        self.name = name
+        self.command = ESC + b"t" + bytes([CODEPAGES[name]])
+        # Non-ASCII character -> the byte that prints it, as a latin-1 char
+        # so str.translate + encode("latin-1") converts a whole line at once
+        self.table = {}
+        decoded = bytes(range(128, 256)).decode(name, errors="replace")
+        for byte, char in enumerate(decoded, 128):
+            if char != "\ufffd" and ord(char) not in self.table:
+                self.table[ord(char)] = chr(byte)
+        self.chars = frozenset(chr(code) for code in self.table)
+
+    def encode(self, text, errors="strict"):
+        translated = text.translate(self.table)
+        return translated.encode("latin-1", errors=errors)
+
+
+class TextEncoder:
+    """
+    Turns receipt text into printer bytes. ASCII is sent as is; other text
+    is converted to the first configured codepage that has all of its
+    characters, switching codepages with ESC t. Lines no codepage can print
+    (e.g. Bengali) are drawn with a TrueType font and sent as GS v 0
+    bitmaps. Rendered words and lines are cached, so repeated menu item
+    names are only drawn once.
+    """
+
+    def __init__(
+        self, codepages=("cp437",), fonts=(), raster=None, cache=None, max_width=576
+    ):
+        """
+        :param codepages: Names from CODEPAGES, in order of preference.
+        :param fonts: TrueType font files to try for bitmap text, in order.
+        :param raster: Callable (1-bit PIL image) -> GS v 0 command bytes.
+        :param cache: image_cache.RasterCache for rendered lines.
+        :param max_width: Printable width in dots, wider bitmap lines are cut.
+        """
+        self.codepages = [Codepage(name) for name in codepages]
+        self.by_name = {codepage.name: codepage for codepage in self.codepages}
+        self.fonts = list(fonts)
+        self.raster = raster
+        self.cache = cache if cache is not None else RasterCache(2 * 1024 * 1024)
+        self.max_width = max_width
+        # FreeType fonts aren't thread safe, render threads take turns
+        self.font_lock = threading.Lock()
+        self.font = functools.lru_cache(maxsize=16)(self._load_font)
+        self._word_image = functools.lru_cache(maxsize=4096)(self._render_word)
+        self.lines_rendered = 0
+
+    def codepage_for(self, text, current=None):
+        """The codepage to print text with (the current one if it can), or None"""
+        needed = {char for char in text if ord(char) > 127}
+        if current is not None and current in self.by_name:
+            if self.by_name[current].chars.issuperset(needed):
+                return self.by_name[current]
+        for codepage in self.codepages:
+            if codepage.chars.issuperset(needed):
+                return codepage
+        return None
+
+    def encode(self, text, codepage=None, scale=1, small=False):
+        """
+        Printer bytes for text, which may span several lines.
+        :param codepage: Name of the codepage the printer is set to, None for
+            its default.
+        :param scale: Character size multiplier of bitmap lines, 2 for text
+            printed at double width and height.
+        :param small: The text is printed in Font B.
+        :return: (bytes, name of the codepage the printer is left in)
+        """
+        output = bytearray()
+        lines = text.split("\n")
+        for index, line in enumerate(lines):
+            last = index == len(lines) - 1
+            if line.isascii():
+                output.extend(line.encode())
+            else:
+                selected = self.codepage_for(line, codepage)
+                if selected is not None:
+                    if selected.name != codepage:
+                        output.extend(selected.command)
+                        codepage = selected.name
+                    output.extend(selected.encode(line))
+                else:
+                    bitmap = self.render_line(line, scale, small)
+                    if bitmap is not None:
+                        output.extend(bitmap)
+                        # The bitmap already moved the paper to the next line
+                        continue
+                    fallback = self.by_name.get(codepage) or self.codepages[0]
+                    if fallback.name != codepage:
+                        output.extend(fallback.command)
+                        codepage = fallback.name
+                    output.extend(fallback.encode(line, errors="replace"))
+            if not last:
+                output.extend(b"\n")
+        return bytes(output), codepage
+
+    def _load_font(self, size):
+        """The first of the fonts that loads, at size pixels, or None"""
+        from PIL import ImageFont
+
+        for path in self.fonts:
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+        return None
+
+    def _render_word(self, word, size):
+        from PIL import Image, ImageDraw
+
+        font = self.font(size)
+        ascent, descent = font.getmetrics()
+        width = max(int(font.getlength(word)) + 1, 1)
+        image = Image.new("L", (width, ascent + descent), 255)
+        ImageDraw.Draw(image).text((0, 0), word, font=font, fill=0)
+        return image
+
+    def render_line(self, line, scale=1, small=False):
+        """
+        GS v 0 bitmap of one line of text, or None when no font is available.
+        Each word starts at the column the printer would have printed it
+        in, so padded receipt columns still line up.
+        """
+        if self.raster is None:
+            return None
+        cell_width, cell_height = FONT_B_CELL if small else FONT_A_CELL
+        size = cell_height * scale
+        with self.font_lock:
+            font = self.font(size)
+        if font is None:
+            return None
+        key = RasterCache.make_key(line, scale=scale, small=small)
+        command = self.cache.get(key)
+        if command is not None:
+            return command
+
+        from PIL import Image
+
+        placed = []
+        with self.font_lock:
+            for match in _WORDS.finditer(line):
+                x = match.start() * cell_width * scale
+                if x >= self.max_width:
+                    break
+                placed.append((x, self._word_image(match.group(), size)))
+        ascent, descent = font.getmetrics()
+        width = max([x + image.width for x, image in placed] + [8])
+        canvas = Image.new("L", (min(width, self.max_width), ascent + descent), 255)
+        for x, image in placed:
+            canvas.paste(image, (x, 0))
+        command = self.raster(canvas.point(lambda value: 255 if value >= 128 else 0, "1"))
+        self.cache.put(key, command)
+        self.lines_rendered += 1
+        return command
+
+    def stats(self):
+        words = self._word_image.cache_info()
+        return {
+            "codepages": [codepage.name for codepage in self.codepages],
+            "lines": self.cache.stats(),
+            "lines_rendered": self.lines_rendered,
+            "words": {"cached": words.currsize, "hits": words.hits, "misses": words.misses},
+        }
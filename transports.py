@@ -0,0 +1,260 @@
+import select
+import socket
+import sys
+import threading
+from collections import deque
+
+try:
+    import win32print
+except ImportError:  # Not on Windows, only the tcp and sink transports work
+    win32print = None
+
+
+# Transport used for printers without an explicit entry in PRINTER_TRANSPORTS
+DEFAULT_TRANSPORT = "win32" if sys.platform == "win32" else "sink"
+
+
+class Transport:
+    """Base class for the ways raw ESC/POS bytes can reach a printer"""
+
+    def __init__(self, printer_name):
+        self.printer_name = printer_name
+        # Held for a whole job so two threads never interleave their
+        # ESC/POS bytes on the same printer
+        self.device_lock = threading.Lock()
+
+    def write(self, raw_data):
+        """Send one complete print job, raising on failure"""
+        raise NotImplementedError
+
+    def send(self, raw_data):
+        """Write a print job while holding the device lock"""
+        with self.device_lock:
+            self.write(raw_data)
+
+    def query_status(self):
+        """status(), waiting for any job being written to finish first"""
+        with self.device_lock:
+            return self.status()
+
+    def status(self):
+        """
+        Ask the printer how it is doing.
+        :return: Dict with "online", "paper_out" and "error" flags, or None if
+            the transport can't tell.
+        """
+        return None
+
+    def close(self):
+        """Release any connections or handles held by the transport"""
+
+
+class Win32Transport(Transport):
+    """Sends RAW documents through the Windows print spooler"""
+
+    def __init__(self, printer_name, default_printer=None):
+        """
+        :param default_printer: Callable returning the default printer name,
+            e.g. from a PrinterCache. Defaults to asking the spooler.
+        """
+        super().__init__(printer_name)
+        self.default_printer = default_printer
+
+    def _device_name(self):
+        printer_name = self.printer_name
+        if not printer_name or printer_name.lower() == "default":
+            if self.default_printer is not None:
+                printer_name = self.default_printer()
+            if not printer_name or printer_name.lower() == "default":
+                printer_name = win32print.GetDefaultPrinter()
+        return printer_name
+
+    def write(self, raw_data):
+        if win32print is None:
+            raise RuntimeError("The Windows spooler is not available on this system")
+
+        # Get the default printer if none specified
+        printer_name = self._device_name()
+
+        hPrinter = win32print.OpenPrinter(printer_name)
+        try:
+            win32print.StartDocPrinter(hPrinter, 1, ("Receipt", None, "RAW"))
+            try:
+                win32print.StartPagePrinter(hPrinter)
+                win32print.WritePrinter(hPrinter, bytes(raw_data))
+                win32print.EndPagePrinter(hPrinter)
+            finally:
+                win32print.EndDocPrinter(hPrinter)
+        finally:
+            win32print.ClosePrinter(hPrinter)
+
+    def status(self):
+        if win32print is None:
+            return None
+        printer_name = self._device_name()
+        hPrinter = win32print.OpenPrinter(printer_name)
+        try:
+            flags = win32print.GetPrinter(hPrinter, 2)["Status"]
+        finally:
+            win32print.ClosePrinter(hPrinter)
+        return {
+            "online": not flags & win32print.PRINTER_STATUS_OFFLINE,
+            "paper_out": bool(flags & win32print.PRINTER_STATUS_PAPER_OUT),
+            "error": bool(
+                flags
+                & (win32print.PRINTER_STATUS_ERROR | win32print.PRINTER_STATUS_PAPER_JAM)
+            ),
+        }
+
+
+class RawTcpTransport(Transport):
+    """
+    Writes straight to a network ESC/POS printer (JetDirect / port 9100).
+    Connections are kept open and reused between jobs.
+    """
+
+    def __init__(self, printer_name, host, port=9100, timeout=10, pool_size=2):
+        super().__init__(printer_name)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return sock
+
+    @staticmethod
+    def _is_open(sock):
+        """
+        Whether a pooled connection can still be used. Writing to one the
+        printer has closed usually succeeds anyway and the data is lost, so
+        it is checked first: a readable socket with nothing to read means
+        the printer hung up, and unrequested bytes would be mistaken for a
+        status reply later.
+        """
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return True
+            sock.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def _acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                sock = self.idle.pop()
+            if self._is_open(sock):
+                return sock, True
+            sock.close()
+        return self._connect(), False
+
+    def _release(self, sock):
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(sock)
+                return
+        sock.close()
+
+    def write(self, raw_data):
+        sock, reused = self._acquire()
+        try:
+            sock.sendall(raw_data)
+        except OSError:
+            sock.close()
+            if not reused:
+                raise
+            # The pooled connection went stale (printer restarted, idle
+            # timeout); retry once on a fresh one
+            sock = self._connect()
+            try:
+                sock.sendall(raw_data)
+            except OSError:
+                sock.close()
+                raise
+        self._release(sock)
+
+    def _query(self, sock, n):
+        # DLE EOT n: real-time status, answered with a single byte even
+        # while the printer is busy printing
+        sock.sendall(b"\x10\x04" + bytes([n]))
+        reply = sock.recv(1)
+        if not reply:
+            raise OSError("Printer closed the connection")
+        return reply[0]
+
+    def status(self):
+        sock, _ = self._acquire()
+        try:
+            printer = self._query(sock, 1)
+            paper = self._query(sock, 4)
+        except OSError:
+            sock.close()
+            raise
+        self._release(sock)
+        return {
+            "online": not printer & 0x08,  # bit 3: offline
+            "paper_out": bool(paper & 0x60),  # bits 5-6: roll paper end
+            "paper_near_end": bool(paper & 0x0C),  # bits 2-3: near end
+            "error": False,
+        }
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
+
+
+class SinkTransport(Transport):
+    """
+    Keeps the last jobs in memory and optionally appends them to a file.
+    Lets the server run and be benchmarked without a real printer.
+    """
+
+    def __init__(self, printer_name, path=None, keep=100):
+        super().__init__(printer_name)
+        self.path = path
+        self.jobs = deque(maxlen=keep)
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    def write(self, raw_data):
+        data = bytes(raw_data)
+        with self.lock:
+            self.jobs.append(data)
+            self.bytes_written += len(data)
+            if self.path:
+                with open(self.path, "ab") as f:
+                    f.write(data)
+
+    def status(self):
+        return {"online": True, "paper_out": False, "error": False}
+
+
+TRANSPORT_TYPES = {
+    "win32": Win32Transport,
+    "tcp": RawTcpTransport,
+    "sink": SinkTransport,
+}
+
+
+def create_transport(printer_name, options=None):
+    """
+    Build the transport for a printer.
+    :param printer_name: Name the rest of the server uses for the printer.
+    :param options: Dict with a "type" key (win32, tcp or sink) plus keyword
+        arguments for that transport, e.g. {"type": "tcp", "host": "10.0.0.5"}.
+    """
+    options = dict(options or {})
+    kind = options.pop("type", DEFAULT_TRANSPORT)
+    if kind not in TRANSPORT_TYPES:
+        raise ValueError(f"Unknown transport type '{kind}' for {printer_name}")
+    return TRANSPORT_TYPES[kind](printer_name, **options)